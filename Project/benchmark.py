@@ -0,0 +1,218 @@
+"""
+Benchmarks of the post-processing pipeline for growing grid and output sizes.
+Runs without the simulator, on synthetic output files with the same variables as the simulation output.
+Every result is appended as a line of JSON to the output file, together with the current git commit, so runs of different commits can be compared.
+
+Usage (from the Project folder):
+    python benchmark.py                                  # default matrix of sizes
+    python benchmark.py --nx 400 1000 --maxout 100 6000  # chosen sizes
+    python benchmark.py --compare <commit> <commit>      # compares two earlier benchmark runs
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+import subprocess
+import tracemalloc
+import numpy as np
+from netCDF4 import Dataset
+from methods.SolutionClass2 import SolutionClass, _find_limits
+from methods.extract_data import extract_data
+from methods.save_load_data2 import save_data, load_data
+from methods.wavefront import get_wavefront_datapoint
+from methods.make_input import make_plasma_input
+
+STAGES = ["extract_data", "extract_views", "save_npy", "load_npy", "save_json", "load_json", "wavefront", "find_limits", "animate_all"]
+
+
+def make_synthetic_output(nc_file: str, Nx: int, maxout: int, seed: int = 0):
+    """
+    Writes a netCDF file shaped like the simulation output: a travelling soft step with some noise.
+    Returns the params dict belonging to the file
+    """
+
+    params = make_plasma_input()
+    params["grid"]["Nx"] = Nx
+    params["output"]["maxout"] = maxout
+    x0, x1 = params["grid"]["x"]
+    tend = params["output"]["tend"]
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(x0, x1, Nx)
+    t = np.linspace(0, tend, maxout+1)
+    step = (x[None, :] - 0.3*(x1-x0)*t[:, None]/tend) / (0.05*(x1-x0))
+    density = 0.6 - 0.4*np.tanh(step) + 1e-3*rng.standard_normal((maxout+1, Nx))
+
+    with Dataset(nc_file, "w", format="NETCDF4") as ncout:
+        ncout.createDimension("time", None)
+        ncout.createDimension("x", Nx)
+        ncout.createVariable("time", "f8", ("time",))[:] = t
+        ncout.createVariable("x", "f8", ("x",))[:] = x
+        fields = {
+            "ions"      : density,
+            "electrons" : 0.99*density,
+            "ue"        : 0.1*np.sin(step),
+            "ui"        : 0.05*np.cos(step),
+            "te"        : density,
+            "ti"        : 0.5*density,
+            "potential" : np.log(density),
+        }
+        for name, field in fields.items():
+            ncout.createVariable(name, "f8", ("time", "x"))[:] = field
+        ncout.createVariable("nsteps",   "i4", ("time",))[:] = 10*np.arange(maxout+1)
+        ncout.createVariable("failed",   "i4", ("time",))[:] = np.arange(maxout+1)//3
+        ncout.createVariable("duration", "f8", ("time",))[:] = 1e-2*np.arange(maxout+1)
+
+    return params
+
+
+def open_synthetic(nc_file: str, params: dict):
+    """
+    Makes a SolutionClass from a synthetic output file, the same way SolutionClass does after running the simulation
+    """
+    sol = SolutionClass()
+    sol.params    = params
+    sol.constants = make_plasma_input()
+    sol._open_output(nc_file)
+    return sol
+
+
+def measure(func):
+    """
+    Runs func and returns (wall time in seconds, peak traced memory in MB)
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak/1e6
+
+
+def run_stages(Nx: int, maxout: int, stages: list, work_dir: str):
+    """
+    Times every stage for a single size. Every stage gets freshly opened data, so nothing is reused between stages
+    """
+
+    nc_file = os.path.join(work_dir, f"synthetic_{Nx}_{maxout}.nc")
+    params = make_synthetic_output(nc_file, Nx, maxout)
+    saved  = os.path.join(work_dir, f"saved_{Nx}_{maxout}")
+    saved_json = os.path.join(work_dir, f"saved_json_{Nx}_{maxout}")
+
+    def loaded():
+        sol = open_synthetic(nc_file, params)
+        sol.close()
+        return sol
+
+    def prepare(stage):
+        """
+        Does the setup of a stage that should not be timed and returns the function to time
+        """
+        if stage == "extract_data":
+            def run():
+                with Dataset(nc_file, "r", format="NETCDF4") as ncin:
+                    extract_data(ncin.variables, params, only_last=True)
+                    extract_data(ncin.variables, params, only_last=False)
+            return run
+        if stage == "extract_views":
+            return lambda: open_synthetic(nc_file, params).close()
+        if stage == "save_npy":
+            sol = loaded()
+            return lambda: save_data(sol, saved)
+        if stage == "save_json":
+            sol = loaded()
+            return lambda: save_data(sol, saved_json, format="json")
+        if stage == "load_npy":
+            if not os.path.isdir(saved + ".run"): save_data(loaded(), saved)
+            return lambda: np.sum(load_data(saved).data_full["ni"])
+        if stage == "load_json":
+            if not os.path.isfile(saved_json + ".json"): save_data(loaded(), saved_json, format="json")
+            return lambda: load_data(saved_json)
+        if stage == "wavefront":
+            data_full = loaded().data_full
+            return lambda: get_wavefront_datapoint(data_full, "ni", offset=0.6)
+        if stage == "find_limits":
+            data_full = loaded().data_full
+            return lambda: [_find_limits(data_full[key]) for key in ("ne", "ni", "potential", "electric")]
+        if stage == "animate_all":
+            sol = open_synthetic(nc_file, params)
+            return lambda: sol.animate_all(os.path.join(work_dir, "bench.mp4"), preview=True, stride=max(1, maxout//20))
+        raise ValueError(f"Unknown stage '{stage}'")
+
+    results = []
+    for stage in stages:
+        func = prepare(stage)
+        try:
+            duration, peak = measure(func)
+        except (OSError, RuntimeError) as error:
+            print(f"{stage} failed for Nx = {Nx}, maxout = {maxout}: {error}")
+            continue
+        results.append({"stage": stage, "Nx": Nx, "maxout": maxout, "seconds": duration, "peak_mb": peak})
+
+    return results
+
+
+def git_commit():
+    """
+    The current git commit, or 'unknown' outside of a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(output: str, old: str, new: str):
+    """
+    Prints the ratio of the times and peak memory of every stage and size between two benchmarked commits (best of each)
+    """
+
+    best = {}
+    with open(output, "r") as file:
+        for line in file:
+            result = json.loads(line)
+            if result["commit"] not in (old, new):
+                continue
+            key = (result["commit"], result["stage"], result["Nx"], result["maxout"])
+            seconds, peak = best.get(key, (np.inf, np.inf))
+            best[key] = (min(seconds, result["seconds"]), min(peak, result["peak_mb"]))
+
+    print("{:>14} {:>6} {:>7} {:>10} {:>10} {:>7} {:>10} {:>10}".format("stage", "Nx", "maxout", "old [s]", "new [s]", "ratio", "old [MB]", "new [MB]"))
+    for (commit, stage, Nx, maxout), (seconds, peak) in sorted(best.items(), key=lambda item: item[0][1:]):
+        if commit != old or (new, stage, Nx, maxout) not in best:
+            continue
+        new_seconds, new_peak = best[(new, stage, Nx, maxout)]
+        print("{:>14} {:>6} {:>7} {:>10.4f} {:>10.4f} {:>7.2f} {:>10.1f} {:>10.1f}".format(stage, Nx, maxout, seconds, new_seconds, new_seconds/seconds, peak, new_peak))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the post-processing pipeline")
+    parser.add_argument("--nx",      type=int, nargs="+", default=[32, 400, 1000])
+    parser.add_argument("--maxout",  type=int, nargs="+", default=[20, 100, 1000])
+    parser.add_argument("--stages",  nargs="+", default=[stage for stage in STAGES if stage != "animate_all"], choices=STAGES)
+    parser.add_argument("--repeat",  type=int, default=1, help="Number of times every stage is timed")
+    parser.add_argument("--output",  default="benchmark_results.jsonl", help="File the results are appended to")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two benchmarked commits in the output file")
+    args = parser.parse_args(argv)
+
+    if args.compare is not None:
+        compare(args.output, *args.compare)
+        return
+
+    commit = git_commit()
+    with tempfile.TemporaryDirectory() as work_dir, open(args.output, "a") as output:
+        for Nx, maxout, _ in itertools.product(args.nx, args.maxout, range(args.repeat)):
+            for result in run_stages(Nx, maxout, args.stages, work_dir):
+                result.update({"commit": commit, "time": time.time(), "python": sys.version.split()[0], "numpy": np.__version__})
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+                print("{stage:>14} Nx = {Nx:>5} maxout = {maxout:>5}: {seconds:9.4f}s, peak {peak_mb:9.1f} MB".format(**result))
+
+
+if __name__ == "__main__":
+    main()
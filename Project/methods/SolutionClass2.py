@@ -1,12 +1,26 @@
-import numpy as np
-import itertools
+import os
 import copy
-from netCDF4 import Dataset
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import simplesimdb as simplesim
-from methods.extract_data import extract_data
+import shutil
+import tempfile
+import weakref
+import subprocess
+import concurrent.futures
+import numpy as np
+# matplotlib, netCDF4 and simplesimdb are imported where they are used, so loading and analysing saved runs starts fast
+from methods.extract_data import LazyData, extract_views, iter_data
 from methods.make_input import make_plasma_input
+from methods.cache import CACHE_CONFIG, params_key, cache_lookup, cache_store
+from methods.instrument import Instrumentation
+from methods.misc import read_only, read_only_copy
+
+# Layout of the plots made by animate_all: (key, title, ylabel) for every row and column
+ANIMATION_LAYOUT = [
+    [("ne",     "Electron density", "$n_e$"),       ("ue",        "Electron velocity", "$u_e$"),  ("Te",       "Electron Temperature", "$T_e$")],
+    [("ni",     "Ion density",      "$n_i$"),       ("ui",        "Ion velocity",      "$u_i$"),  ("Ti",       "Ion Temperature",      "$T_i$")],
+    [("charge", "Charge density",   "$n_i - n_e$"), ("potential", "Potential",         r"$\phi$"), ("electric", "Electric field",       "$E$")],
+]
+ANIMATION_FIELDS  = [key for row in ANIMATION_LAYOUT for key, _, _ in row]
+ANIMATION_FIGSIZE = (3*10, 3*8)
 
 class SolutionClass:
     """
@@ -17,6 +31,12 @@ class SolutionClass:
     self.constants: dict of constants used for the simulation
     self.data: Dict of the data for the last time of the simulation
     self.data_full: The data for every outputted time of the simulation
+
+    use_cache: Whether to reuse the output of an earlier simulation with the same params and executable (see methods/cache.py).
+               Defaults to CACHE_CONFIG["enabled"]
+    lazy:      Whether to keep the simulation output open and only read every entry the first time it is used.
+               The output is then kept in a file of its own next to temp_nc_file, which is removed by close() or once the data is no longer used.
+               Otherwise everything is read at once and the file is closed
     """
 
     def __init__(self, params: dict = None,
@@ -24,6 +44,8 @@ class SolutionClass:
                  temp_json_file = "temp/temp.json",
                  temp_nc_file   = "temp/temp.nc",
                  updates = False,
+                 use_cache = None,
+                 lazy = False,
                 ):
 
         # Initializes class fields for manual setting after empty input
@@ -31,43 +53,167 @@ class SolutionClass:
         self.constants = {}
         self.data      = {}
         self.data_full = {}
+        self._ncin     = None
+        self._own_file = None # Output file of this object only, removed when closed
+        self.instrumentation = Instrumentation() # Wall time and memory of every stage, see self.stats()
+        self.stopped_by = None # Name of the stopping condition that ended a monitored run early (see methods/monitor.py)
+        self.storage    = None # Storage profile and lost precision of a run loaded with load_data (see STORAGE_PROFILES)
 
         if params != None:
-            # Saves parameter list in case this needs to be pulled out later
-            if updates: print("copying params")
-            self.params = copy.deepcopy(params)
+            inst = self.instrumentation
 
-            if updates: print("making plasma input")
-            self.constants = make_plasma_input()
+            # Saves parameter list in case this needs to be pulled out later
+            with inst.stage("input"):
+                if updates: print("copying params")
+                self.params = copy.deepcopy(params)
+
+                if updates: print("making plasma input")
+                self.constants = make_plasma_input()
+
+            # Reuses the output of an earlier identical simulation if possible
+            if use_cache is None: use_cache = CACHE_CONFIG["enabled"]
+            nc_file = None
+            if use_cache:
+                with inst.stage("cache_lookup"):
+                    key = params_key(self.params, two_fluid_file)
+                    nc_file = cache_lookup(key)
+                if updates and nc_file is not None: print("found cached simulation")
+            store = use_cache and nc_file is None
 
             # Simulates the system with the given list of parameters
-            if updates: print("setting up repeater")
-            rep = simplesim.Repeater(two_fluid_file, temp_json_file, temp_nc_file)
-            rep.clean()
-            if updates: print("runs repeater")
-            rep.run(params, error="display", stdout="ignore")
-            if updates: print("extracts data")
-            ncin = Dataset(temp_nc_file, 'r', format="NETCDF4")
-
-            self.data      = extract_data(ncin.variables, params=params, only_last=True)
-            self.data_full = extract_data(ncin.variables, params=params, only_last=False)
-
-            if updates: print("closing ncin")
-            ncin.close()
+            if nc_file is None:
+                if updates: print("setting up repeater")
+                import simplesimdb as simplesim
+                rep = simplesim.Repeater(two_fluid_file, temp_json_file, temp_nc_file)
+                rep.clean()
+                if updates: print("runs repeater")
+                with inst.stage("simulation"):
+                    rep.run(self.params, error="display", stdout="ignore")
+                nc_file = temp_nc_file
+
+            if updates: print("opening ncin")
+            with inst.stage("open"):
+                if lazy:
+                    nc_file = self._own_output(nc_file, temp_nc_file)
+                self._open_output(nc_file)
+
+            # Only finished simulations are cached
+            if store and _reached_tend(self._ncin.variables, self.params):
+                if updates: print("caching simulation")
+                with inst.stage("cache_store"):
+                    cache_store(key, nc_file)
+
+            if not lazy:
+                if updates: print("reading data")
+                self.close()
             if updates: print("Done!")
 
-    # Getters for certain mutable data so they wont be changed elsewhere in code
+    def _own_output(self, nc_file, temp_nc_file):
+        """
+        Gives the output a file of its own next to temp_nc_file, so the next simulation can neither overwrite nor remove it while it is open.
+        The simulation output is moved there, a cached output is linked (or copied where links are not possible)
+        """
+        fd, path = tempfile.mkstemp(prefix="output-", suffix=".nc", dir=os.path.dirname(os.path.abspath(temp_nc_file)))
+        os.close(fd)
+        if os.path.abspath(nc_file) == os.path.abspath(temp_nc_file):
+            os.replace(nc_file, path)
+        else:
+            os.remove(path)
+            try:
+                os.link(nc_file, path)
+            except OSError:
+                shutil.copyfile(nc_file, path)
+        self._own_file = path
+        return path
+
+    def _open_output(self, nc_file):
+        """
+        Opens the simulation output and makes the lazy data views. The data is read from the file the first time it is used
+        """
+        from netCDF4 import Dataset
+        self._ncin = Dataset(nc_file, 'r', format="NETCDF4")
+
+        # The own file is removed once the data views reading from it are gone, if close() is never called
+        if self._own_file is not None:
+            self._remove_own_file = weakref.finalize(self._ncin, _remove_file, self._own_file)
+        self.data, self.data_full = extract_views(self._ncin.variables, params=self.params)
+
+        # Counters reported by the simulator
+        if self._ncin.variables["time"].shape[0] > 0:
+            for key in ("nsteps", "nfailed", "duration"):
+                self.instrumentation.counters[key] = self.data[key]
+
+    def stats(self):
+        """
+        Gives the recorded wall time and memory of every stage, the simulator counters, and the time spent loading every entry of the data.
+        See methods/instrument.py for exporting the statistics of many runs
+        """
+        stats = self.instrumentation.to_dict()
+        stats["label"]  = self.data_full.get("label") if len(self.data_full) > 0 else None
+        stats["Nx"]     = self.params.get("grid", {}).get("Nx")
+        stats["maxout"] = self.params.get("output", {}).get("maxout")
+        stats["stopped_by"] = self.stopped_by
+        stats["load_seconds"] = {}
+        for data in (self.data_full, self.data):
+            if isinstance(data, LazyData):
+                for key, seconds in data.load_seconds.items():
+                    stats["load_seconds"][key] = stats["load_seconds"].get(key, 0.0) + seconds
+        return stats
+
+    def close(self):
+        """
+        Reads all of the data that has not been used yet from the simulation output and closes the file.
+        Derived quantities are still only computed when used. The own output file of a lazy run is removed
+        """
+        if self._ncin is None:
+            return
+
+        with self.instrumentation.stage("extract"):
+            for data in (self.data_full, self.data):
+                if isinstance(data, LazyData):
+                    data.load(derived=False)
+
+        with self.instrumentation.stage("close"):
+            self._ncin.close()
+            if self._own_file is not None:
+                self._remove_own_file()
+        self._ncin = None
+        self._own_file = None
+
+    def __getstate__(self):
+        # The open file can not be pickled. The lazy data is loaded completely when pickled instead
+        state = self.__dict__.copy()
+        state["_ncin"] = None
+        state["_own_file"] = None
+        state.pop("_remove_own_file", None)
+        return state
+
+    def iter_data(self, fields: list = None, chunk_size: int = None, start: int = 0, stop: int = None, step: int = 1):
+        """
+        Goes through the data in time, so only chunk_size time steps are in memory at once. See extract_data.iter_data
+        Reads directly from the simulation output while it is open, and from data_full otherwise (memory-mapped for runs loaded with load_data)
+
+        Example:
+            for chunk in sol.iter_data(["ni", "electric"], chunk_size=100):
+                ...
+        """
+        source = self.data_full if self._ncin is None else self._ncin.variables
+        return iter_data(source, self.params, fields=fields, chunk_size=chunk_size, start=start, stop=stop, step=step)
+
+    # Getters for certain mutable data so they wont be changed elsewhere in code.
+    # They give read-only views and dicts (see misc.read_only) instead of deep copies, so the array data is never copied.
+    # Use copy.deepcopy on the result for a copy that can be changed
     def get_params(self):
-        return copy.deepcopy(self.params)
+        return read_only_copy(self.params)
     
     def get_constants(self):
-        return copy.deepcopy(self.constants)
+        return read_only_copy(self.constants)
     
     def get_data(self):
-        return copy.deepcopy(self.data)
+        return read_only(self.data)
     
     def get_data_full(self):
-        return copy.deepcopy(self.data_full)
+        return read_only(self.data_full)
 
     def print_diagnostics(self):
         """
@@ -81,6 +227,8 @@ class SolutionClass:
         Plots the final iteration state for the electron density, velocity, and temperature
         """
 
+        import matplotlib.pyplot as plt
+
         # Prepare plot
         frows, fcols = 1, 3
         plt.rcParams.update({'font.size': 18})
@@ -115,6 +263,8 @@ class SolutionClass:
         Plots the final iteration state for the ion density, velocity, and temperature
         """
 
+        import matplotlib.pyplot as plt
+
         # Prepare plot
         frows, fcols = 1, 3
         plt.rcParams.update({'font.size': 18})
@@ -149,6 +299,8 @@ class SolutionClass:
         Plots the final iteration state for the charge density, potential and electric field
         """
 
+        import matplotlib.pyplot as plt
+
         # Prepare plot
         frows, fcols = 1, 3
         plt.rcParams.update({'font.size': 18})
@@ -187,104 +339,54 @@ class SolutionClass:
         self.plot_ions()
         self.plot_fields()
 
-    def animate_all(self, filename="testplot.mp4", fps=20):
+    def animate_all(self, filename="testplot.mp4", fps=20, stride=1, preview=False, workers=1):
         """
         animates all of the plots for every time. Can take a while for moderately large datasets
+        fps:     Frames per second of the video
+        stride:  Only every stride'th output time is made into a frame
+        preview: Renders at a much lower resolution for a quick look
+        workers: Number of processes rendering frames. With more than one, the frames are split into a chunk per worker,
+                 every worker pipes its raw frames into its own ffmpeg segment and the segments are joined at the end.
+                 Workers read their frames directly from the output file of a lazy run, or are only sent their own chunk of data_full
         """
 
-        frows = 3
-        fcols = 3
-
-        fig,ax=plt.subplots(frows,fcols,figsize=(fcols*10,frows*8),dpi=300, facecolor='w', edgecolor='k')
+        frames = range(0, len(self.data_full["t"]), stride)
+        setup = {
+            "Nx"     : self.params['grid']['Nx'],
+            "label"  : self.data_full["label"],
+            "x"      : np.asarray(self.data_full["x"]),
+            "limits" : _stream_limits(self),
+            "dpi"    : 30 if preview else 150,
+        }
 
-        # Common plot options
-        for ax_single in itertools.chain.from_iterable(zip(*ax)):
-            ax_single.set_xlabel("$x$")
-            ax_single.grid(True)
+        if workers > 1:
+            _animate_parallel(self, filename, fps, frames, setup, workers)
+            return
 
-        #ax[0][0].legend()
-        ax[0][0].set_title("Electron density")
-        ax[0][1].set_title("Electron velocity")
-        ax[0][2].set_title("Electron Temperature")
-        ax[0][0].set_ylabel("$n_e$")
-        ax[0][1].set_ylabel("$u_e$")
-        ax[0][2].set_ylabel("$T_e$")
-        try: ax[0][0].set_ylim(_find_limits(self.data_full["ne"]))
-        except: print("ne plot limits failed")
-        try: ax[0][1].set_ylim(_find_limits(self.data_full["ue"]))
-        except: print("ue plot limits failed")
-        try: ax[0][2].set_ylim(_find_limits(self.data_full["Te"]))
-        except: print("Te plot limits failed")
-        
-        ax[1][0].set_title("Ion density")
-        ax[1][1].set_title("Ion velocity")
-        ax[1][2].set_title("Ion Temperature")
-        ax[1][0].set_ylabel("$n_i$")
-        ax[1][1].set_ylabel("$u_i$")
-        ax[1][2].set_ylabel("$T_i$")
-        try: ax[1][0].set_ylim(_find_limits(self.data_full["ni"]))
-        except: print("ni plot limits failed")
-        try: ax[1][1].set_ylim(_find_limits(self.data_full["ui"]))
-        except: print("ui plot limits failed")
-        try: ax[1][2].set_ylim(_find_limits(self.data_full["Ti"]))
-        except: print("Ti plot limits failed")
-
-        ax[2][0].set_title("Charge density")
-        ax[2][1].set_title("Potential")
-        ax[2][2].set_title("Electric field")
-        ax[2][0].set_ylabel("$n_i - n_e$")
-        ax[2][1].set_ylabel(r"$\phi$")
-        ax[2][2].set_ylabel("$E$")
-        try: ax[2][0].set_ylim(_find_limits(self.data_full["charge"]))
-        except: print("charge plot limits failed")
-        try: ax[2][1].set_ylim(_find_limits(self.data_full["potential"]))
-        except: print("potential plot limits failed")
-        try: ax[2][2].set_ylim(_find_limits(self.data_full["electric"]))
-        except: print("electric plot limits failed")
-
-
-        title00 = ax[0][0].get_title()
-        ax[0][0].set_title(title00 + " Nx = {} t = {:5.5f}".format(self.params['grid']['Nx'], self.data_full["t"][0]))
-        plots = {}
-
-        plots["ne"], = ax[0][0].plot(self.data_full["x"], self.data_full["ne"][0], lw=4, label=self.data_full["label"])
-        plots["ue"], = ax[0][1].plot(self.data_full["x"], self.data_full["ue"][0], lw=4, label=self.data_full["label"])
-        plots["Te"], = ax[0][2].plot(self.data_full["x"], self.data_full["Te"][0], lw=4, label=self.data_full["label"])
-
-        plots["ni"], = ax[1][0].plot(self.data_full["x"], self.data_full["ni"][0], lw=4, label=self.data_full["label"])
-        plots["ui"], = ax[1][1].plot(self.data_full["x"], self.data_full["ui"][0], lw=4, label=self.data_full["label"])
-        plots["Ti"], = ax[1][2].plot(self.data_full["x"], self.data_full["Ti"][0], lw=4, label=self.data_full["label"])
-
-        plots["charge"],    = ax[2][0].plot(self.data_full["x"], self.data_full["charge"][0], lw=4, label=self.data_full["label"])
-        plots["potential"], = ax[2][1].plot(self.data_full["x"], self.data_full["potential"][0], lw=4, label=self.data_full["label"])
-        plots["electric"],  = ax[2][2].plot(self.data_full["x"], self.data_full["electric"][0], lw=4, label=self.data_full["label"])
+        import matplotlib.pyplot as plt
+        import matplotlib.animation as animation
 
+        fig, ax = plt.subplots(3, 3, figsize=ANIMATION_FIGSIZE, dpi=300, facecolor='w', edgecolor='k')
+        plots, title00 = _setup_animation(ax, setup, self._frame(frames[0]))
 
         def update_plots(iter):
-            ax[0][0].set_title(title00 + " Nx = {} t = {:5.5f}".format(self.params['grid']['Nx'], self.data_full["t"][iter]))
-            plots["ne"].set_data(self.data_full["x"], self.data_full["ne"][iter])
-            plots["ue"].set_data(self.data_full["x"], self.data_full["ue"][iter])
-            plots["Te"].set_data(self.data_full["x"], self.data_full["Te"][iter])
-
-            plots["ni"].set_data(self.data_full["x"], self.data_full["ni"][iter])
-            plots["ui"].set_data(self.data_full["x"], self.data_full["ui"][iter])
-            plots["Ti"].set_data(self.data_full["x"], self.data_full["Ti"][iter])
-
-            plots["charge"].set_data(self.data_full["x"], self.data_full["charge"][iter])
-            plots["potential"].set_data(self.data_full["x"], self.data_full["potential"][iter])
-            plots["electric"].set_data(self.data_full["x"], self.data_full["electric"][iter])
-
-            return plots.values()
+            return _update_animation(ax, plots, title00, setup, self._frame(iter))
 
         ani = animation.FuncAnimation(fig, 
                                       update_plots, 
-                                      frames=self.params["output"]["maxout"], 
+                                      frames=frames, 
                                       interval=2, 
                                       blit=True, 
                                       repeat=True)
-        writer = animation.FFMpegWriter(fps=20, codec='h264')
+        writer = animation.FFMpegWriter(fps=fps, codec='h264')
 
-        ani.save(filename, writer=writer, dpi=150)
+        ani.save(filename, writer=writer, dpi=setup["dpi"])
+
+    def _frame(self, i):
+        """
+        The data of a single frame of animate_all
+        """
+        return next(self.iter_data(ANIMATION_FIELDS, start=i, stop=i+1))
 
 
 ####################
@@ -299,4 +401,165 @@ def _find_limits(data_arr, plottype: str = ""):
     r_temp = (maxi - mini)*0.05
     r = (mini-r_temp, maxi+r_temp)
 
-    return r
\ No newline at end of file
+    return r
+
+
+def _remove_file(path):
+    """
+    Removes a file if it still exists and can be removed
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _reached_tend(var, params):
+    """
+    Checks whether the simulation output reaches the end time of the simulation
+    var: netCDF4 Dataset.variables
+    """
+    if var["time"].shape[0] == 0:
+        return False
+
+    return bool(np.isclose(float(var["time"][-1]), params["output"]["tend"], rtol=1e-6))
+
+
+def _stream_limits(sol):
+    """
+    Finds the plot limits of every animated field, going through the data in chunks so it never has to be loaded completely
+    """
+    mini = {key:  np.inf for key in ANIMATION_FIELDS}
+    maxi = {key: -np.inf for key in ANIMATION_FIELDS}
+    for chunk in sol.iter_data(ANIMATION_FIELDS, chunk_size=256):
+        for key in ANIMATION_FIELDS:
+            mini[key] = min(mini[key], np.min(chunk[key]))
+            maxi[key] = max(maxi[key], np.max(chunk[key]))
+
+    return {key: _find_limits(np.array([mini[key], maxi[key]])) for key in ANIMATION_FIELDS}
+
+
+def _setup_animation(ax, setup, frame):
+    """
+    Sets up the 3x3 axes of animate_all and plots the first frame. Returns the line of every field and the base title
+    """
+    plots = {}
+    for ax_row, layout_row in zip(ax, ANIMATION_LAYOUT):
+        for ax_single, (key, title, ylabel) in zip(ax_row, layout_row):
+            ax_single.set_xlabel("$x$")
+            ax_single.grid(True)
+            ax_single.set_title(title)
+            ax_single.set_ylabel(ylabel)
+            try: ax_single.set_ylim(setup["limits"][key])
+            except ValueError: print(f"{key} plot limits failed")
+
+            plots[key], = ax_single.plot(setup["x"], frame[key], lw=4, label=setup["label"])
+
+    title00 = ax[0][0].get_title()
+    ax[0][0].set_title(title00 + " Nx = {} t = {:5.5f}".format(setup["Nx"], frame["t"]))
+
+    return plots, title00
+
+
+def _update_animation(ax, plots, title00, setup, frame):
+    """
+    Draws a new frame into the axes made by _setup_animation
+    """
+    ax[0][0].set_title(title00 + " Nx = {} t = {:5.5f}".format(setup["Nx"], frame["t"]))
+    for key, plot in plots.items():
+        plot.set_data(setup["x"], frame[key])
+
+    return plots.values()
+
+
+def _animate_parallel(sol, filename, fps, frames, setup, workers):
+    """
+    Renders the frames of animate_all in chunks on several processes and joins the resulting video segments with ffmpeg
+    """
+    import matplotlib.pyplot as plt
+    ffmpeg = plt.rcParams["animation.ffmpeg_path"]
+    temp_dir = tempfile.mkdtemp(prefix="animate-", dir=os.path.dirname(os.path.abspath(filename)))
+
+    try:
+        tasks = []
+        for k, chunk in enumerate(np.array_split(np.array(frames), workers)):
+            if len(chunk) == 0:
+                continue
+            start, stop = int(chunk[0]), int(chunk[-1])+1
+
+            # Workers read directly from the output file of a lazy run, else they only get their own chunk, already strided
+            if sol._ncin is not None and sol._own_file is not None:
+                source, step = sol._own_file, frames.step
+            else:
+                source = {key: np.asarray(sol.data_full[key][start:stop:frames.step]) for key in ["t"] + ANIMATION_FIELDS}
+                source["x"] = setup["x"]
+                start, stop, step = 0, None, 1
+
+            segment = os.path.join(temp_dir, f"segment{k:04d}.mp4")
+            tasks.append((segment, source, sol.params, start, stop, step, fps, setup, ffmpeg))
+
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            segments, counts = zip(*pool.map(_render_segment, tasks))
+
+        if sum(counts) != len(frames):
+            raise RuntimeError(f"The segments have {sum(counts)} frames, but the animation should have {len(frames)}")
+
+        list_file = os.path.join(temp_dir, "segments.txt")
+        with open(list_file, "w") as file:
+            for segment in segments:
+                file.write("file '{}'\n".format(segment))
+
+        subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy", filename], check=True)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _render_segment(task):
+    """
+    Renders a chunk of frames of animate_all into a video segment by piping the raw frames into ffmpeg. Is run by the workers of _animate_parallel.
+    Returns the segment and its number of frames
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from netCDF4 import Dataset
+
+    segment, source, params, start, stop, step, fps, setup, ffmpeg = task
+
+    # Draws without pyplot, so the backend of the notebook does not matter
+    fig = Figure(figsize=ANIMATION_FIGSIZE, dpi=setup["dpi"], facecolor='w', edgecolor='k')
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.subplots(3, 3)
+
+    ncin = Dataset(source, 'r', format="NETCDF4") if isinstance(source, str) else None
+    var  = source if ncin is None else ncin.variables
+
+    process = None
+    count = 0
+    try:
+        plots = None
+        for frame in iter_data(var, params, ANIMATION_FIELDS, start=start, stop=stop, step=step):
+            if plots is None:
+                plots, title00 = _setup_animation(ax, setup, frame)
+            else:
+                _update_animation(ax, plots, title00, setup, frame)
+            canvas.draw()
+
+            if process is None:
+                width, height = canvas.get_width_height()
+                process = subprocess.Popen([ffmpeg, "-y", "-loglevel", "error",
+                                            "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                                            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-pix_fmt", "yuv420p", segment],
+                                           stdin=subprocess.PIPE)
+            process.stdin.write(canvas.buffer_rgba())
+            count += 1
+    finally:
+        if ncin is not None:
+            ncin.close()
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+
+    if process is None or process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to make the segment {segment}")
+
+    return segment, count
@@ -0,0 +1,178 @@
+import os
+import copy
+import itertools
+import numpy as np
+from methods.sweep import run_sweep
+from methods.surrogate import Surrogate
+from methods.save_load_data2 import load_data
+
+
+def adaptive_sweep(params: dict, space: dict, diagnostic, apply = None, inputs = None,
+                   budget: int = 64, batch_size: int = 8, target_std: float = None,
+                   model = "gaussian_process", gradient_weight: float = 1.0, candidates: int = 2000,
+                   save_dir: str = None, processes: int = None,
+                   two_fluid_file = "../temp_plasma",
+                   seed: int = 0,
+                   report: bool = True,
+                   **model_args,
+                  ):
+    """
+    Samples a parameter space adaptively instead of with a full grid. Starts with the corners and the centre of the space,
+    then repeatedly fits a Surrogate of the diagnostic and runs a batch of new points where the surrogate is most uncertain
+    or the diagnostic changes fastest. Stops when the budget of runs is used or the uncertainty is below target_std everywhere.
+
+    params:     Parameter dict every run starts from
+    space:      dict {name: (lowest, highest)} of the sampled parameters
+    diagnostic: Key of a scalar entry of SolutionClass.data or function taking a SolutionClass and returning a number, see Surrogate
+    apply:      Function taking a params dict and a dict {name: value} of a point and setting the parameters of the point.
+                Defaults to setting params["init"][name] = value
+    inputs:     How to read the point back from params["init"] of a run, as in Surrogate, so the returned surrogate can be fitted
+                again on the saved runs. Defaults to params["init"][name]. Has to be given together with apply
+    budget:     Largest number of runs
+    batch_size: Number of new points run at once
+    target_std: Stops when the largest uncertainty of the surrogate is below this
+    gradient_weight: Weight of the change of the diagnostic against the uncertainty when choosing new points. 0 for uncertainty only
+    candidates: Number of random points the new points are chosen from
+    save_dir:   If given, every run is saved there with save_data, named by its point, so the runs can be loaded with load_data
+                or load_many afterwards
+    model, **model_args: Model family of the surrogate, see Surrogate
+
+    Returns dict with
+        "surrogate": the Surrogate fitted to every run
+        "points":    array of shape (runs, parameters) of the sampled points, in the order of space
+        "values":    the diagnostic of every run (nan for failed runs)
+        "runs":      the SolutionClass of every run, or its filename if save_dir is given
+        "max_std":   the largest uncertainty of the surrogate after every batch
+
+    Example (the Shock-shape sweep of Ion_Velocity 3 with a quarter of the runs):
+        def apply(params, point):
+            params["init"].update(n_l=point["namp"], t_l=point["Tamp"], n_r=point["namp"]*point["nrel"], t_r=point["Tamp"]*point["trel"])
+        inputs = {"nrel": lambda i: i["n_r"]/i["n_l"], "trel": lambda i: i["t_r"]/i["t_l"], "namp": lambda i: i["n_l"], "Tamp": lambda i: i["t_l"]}
+        result = adaptive_sweep(params, {"nrel": (0.2, 0.5), "trel": (0.2, 0.5), "namp": (0.8, 2.0), "Tamp": (0.8, 2.0)},
+                                shock_height, apply=apply, inputs=inputs, budget=64, save_dir="DATA/Shock-shape-adaptive")
+    """
+
+    if (apply is None) != (inputs is None):
+        raise ValueError("apply and inputs have to be given together")
+    if apply is None:
+        apply  = _set_init
+        inputs = list(space)
+
+    names = list(space)
+    low   = np.array([space[name][0] for name in names], dtype=float)
+    high  = np.array([space[name][1] for name in names], dtype=float)
+    rng   = np.random.default_rng(seed)
+
+    # Points are chosen with a surrogate in the parameters of space. The returned surrogate uses inputs, read from the params of every run
+    search    = Surrogate(names, diagnostic, model=model, **model_args)
+    surrogate = Surrogate(inputs, diagnostic, model=model, **model_args)
+    result = {"surrogate": surrogate, "points": np.empty((0, len(names))), "values": np.empty(0), "runs": [], "max_std": []}
+    input_points = []
+
+    def run_batch(points):
+        param_list = []
+        for point in points:
+            run_params = copy.deepcopy(params)
+            apply(run_params, dict(zip(names, point)))
+            param_list.append(run_params)
+            input_points.append(surrogate.coordinates(run_params["init"]))
+
+        save_names = None
+        if save_dir is not None:
+            os.makedirs(save_dir, exist_ok=True)
+            save_names = [os.path.join(save_dir, ", ".join(f"{name}={value:.6g}" for name, value in zip(names, point))) for point in points]
+
+        runs   = [None]*len(points)
+        values = np.full(len(points), np.nan)
+        for i, run in run_sweep(param_list, processes=processes, save_names=save_names, two_fluid_file=two_fluid_file, errors="return"):
+            runs[i] = run
+            if isinstance(run, Exception):
+                if report: print(f"Run at {dict(zip(names, points[i]))} failed: {run}")
+                continue
+            sol = load_data(run) if isinstance(run, str) else run
+            values[i] = surrogate.training_data([sol])[1][0]
+
+        result["points"] = np.concatenate([result["points"], points])
+        result["values"] = np.concatenate([result["values"], values])
+        result["runs"]  += runs
+
+    # Coarse start: every corner of the space and its centre
+    initial = np.array(list(itertools.product(*zip(low, high))) + [(low + high)/2])
+    run_batch(initial[:budget])
+
+    while True:
+        finished = np.isfinite(result["values"])
+        if np.sum(finished) == 0:
+            raise RuntimeError("Every run of the initial design failed")
+        search.fit(X=result["points"], y=result["values"])
+
+        pool = low + (high - low)*rng.random((candidates, len(names)))
+        _, std = search.predict(pool)
+        result["max_std"].append(float(np.max(std)))
+
+        if report:
+            print("{} runs. Largest uncertainty {:.4g}".format(len(result["values"]), result["max_std"][-1]))
+        if target_std is not None and result["max_std"][-1] <= target_std:
+            break
+        if len(result["values"]) >= budget:
+            break
+
+        score = std/np.max(std) if np.max(std) > 0 else np.zeros(len(pool))
+        if gradient_weight > 0:
+            gradient = _gradient_size(search, pool, (high - low)*1e-3)
+            if np.max(gradient) > 0:
+                score = score + gradient_weight*gradient/np.max(gradient)
+
+        batch = _spread_out(pool, score, min(batch_size, budget - len(result["values"])), result["points"], low, high)
+        if len(batch) == 0:
+            break
+        run_batch(batch)
+
+    surrogate.fit(X=np.array(input_points, dtype=float), y=result["values"])
+    return result
+
+
+####################
+# Helper functions #
+####################
+def _set_init(params: dict, point: dict):
+    """
+    Default way of setting a point: params["init"][name] = value
+    """
+    params["init"].update(point)
+
+
+def _gradient_size(surrogate: Surrogate, points, step):
+    """
+    Size of the gradient of the surrogate at every point, by central differences, relative to the size of the space
+    """
+    size = np.zeros(len(points))
+    for a in range(points.shape[1]):
+        shift = np.zeros(points.shape[1])
+        shift[a] = step[a]
+        derivative = (surrogate.predict(points + shift, return_std=False) - surrogate.predict(points - shift, return_std=False))/2
+        size += (derivative/1e-3)**2
+    return np.sqrt(size)
+
+
+def _spread_out(pool, score, n: int, existing, low, high):
+    """
+    Takes the n points of the pool with the highest score, skipping points too close to the runs and to the points already taken
+    """
+    scaled = lambda points: (points - low)/np.where(high > low, high - low, 1.0)
+    pool_scaled = scaled(pool)
+    taken_scaled = list(scaled(existing))
+
+    # Distance below which two points count as the same, shrinking with the number of runs
+    min_distance = 0.5/(len(existing) + n)**(1/pool.shape[1])
+
+    chosen = []
+    for i in np.argsort(-score):
+        if len(chosen) == n:
+            break
+        if taken_scaled and np.min(np.linalg.norm(np.array(taken_scaled) - pool_scaled[i], axis=1)) < min_distance:
+            continue
+        chosen.append(pool[i])
+        taken_scaled.append(pool_scaled[i])
+
+    return np.array(chosen).reshape(len(chosen), pool.shape[1])
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from collections.abc import Mapping
+
+# Settings for the simulation result cache. Can be changed at runtime, e.g. CACHE_CONFIG["max_size"] = 10e9
+CACHE_CONFIG = {
+    "enabled"   : True,
+    "directory" : "temp/cache",
+    "max_size"  : 5e9,  # Largest total size of the cache in bytes. None for no limit
+    "max_age"   : None, # Largest time in seconds since an entry was last used. None for no limit
+    "digits"    : 12,   # Significant digits floats are rounded to before hashing
+}
+
+_simulator_ids = {}
+
+
+def canonicalize(obj, digits: int = None):
+    """
+    Transforms a params dict into a canonical form, so equal parameter sets always give the same hash.
+    Keys are sorted, tuples become lists and all numbers are normalized to floats with a fixed number of significant digits
+    obj:    The params dict (or any nested part of it)
+    digits: Significant digits to round floats to. Defaults to CACHE_CONFIG["digits"]
+    """
+
+    if digits is None:
+        digits = CACHE_CONFIG["digits"]
+
+    if isinstance(obj, Mapping):
+        return {str(key): canonicalize(obj[key], digits) for key in sorted(obj.keys(), key=str)}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        return [canonicalize(sub_obj, digits) for sub_obj in obj]
+    if isinstance(obj, (bool, np.bool_)):
+        return bool(obj)
+    if isinstance(obj, (int, float, np.integer, np.floating)):
+        return float("{:.{}g}".format(float(obj), digits)) + 0.0 # + 0.0 turns -0.0 into 0.0
+    return obj
+
+
+def simulator_identity(two_fluid_file):
+    """
+    Returns a hash of the content of the simulation executable, so results are never reused after the simulator is recompiled.
+    The hash is only recomputed if the size or modification time of the file changes.
+    """
+
+    path = shutil.which(two_fluid_file) or two_fluid_file
+    if not os.path.isfile(path):
+        return str(two_fluid_file)
+
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    stamp = (path, stat.st_size, stat.st_mtime_ns)
+
+    if stamp not in _simulator_ids:
+        sha = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                sha.update(block)
+        _simulator_ids[stamp] = sha.hexdigest()
+
+    return _simulator_ids[stamp]
+
+
+def params_key(params: dict, two_fluid_file = "../temp_plasma"):
+    """
+    Gives the cache key of a simulation: a hash of the canonicalized params and the identity of the simulation executable
+    """
+
+    content = json.dumps({"params": canonicalize(params), "simulator": simulator_identity(two_fluid_file)},
+                         sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def cache_lookup(key: str):
+    """
+    Returns the path of the cached netCDF output for the key, or None if it is not in the cache
+    """
+
+    path = _cache_path(key)
+    if not os.path.isfile(path):
+        return None
+
+    os.utime(path) # Marks the entry as recently used
+    return path
+
+
+def cache_store(key: str, nc_file: str):
+    """
+    Puts the netCDF output of a finished simulation into the cache and evicts old entries afterwards.
+    The output is hard-linked into the cache, so it is not written to disk a second time. It is only copied where links are not possible
+    """
+
+    os.makedirs(CACHE_CONFIG["directory"], exist_ok=True)
+    path = _cache_path(key)
+
+    # Links to a temporary name first so other processes never see a half written entry
+    temp_path = "{}.{}.part".format(path, os.getpid())
+    try:
+        os.link(nc_file, temp_path)
+    except OSError:
+        shutil.copyfile(nc_file, temp_path)
+    os.replace(temp_path, path)
+
+    cache_evict()
+    return path
+
+
+def cache_evict(max_size = None, max_age = None):
+    """
+    Removes cache entries not used for longer than max_age seconds, then the least recently used ones until the cache is smaller than max_size bytes.
+    Both default to the values in CACHE_CONFIG
+    """
+
+    if max_size is None: max_size = CACHE_CONFIG["max_size"]
+    if max_age  is None: max_age  = CACHE_CONFIG["max_age"]
+
+    directory = CACHE_CONFIG["directory"]
+    if not os.path.isdir(directory):
+        return
+
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".nc"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError: # Evicted by another process in the meantime
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort() # Least recently used first
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        too_old   = max_age  is not None and now - mtime > max_age
+        too_large = max_size is not None and total_size > max_size
+        if not (too_old or too_large):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def cache_clear():
+    """
+    Removes every entry in the cache
+    """
+
+    cache_evict(max_size=0)
+
+
+####################
+# Helper functions #
+####################
+def _cache_path(key: str):
+    return os.path.join(CACHE_CONFIG["directory"], key + ".nc")
@@ -0,0 +1,142 @@
+import hashlib
+import numpy as np
+from methods.extract_data import DEFAULT_FIELDS, _trapezoid_weights
+
+# Interpolation operators already made, {(source grid, target grid): (indices, weights)}
+_OPERATOR_CACHE = {}
+
+NORMS = ("L1", "L2", "Linf")
+
+
+def common_grid(sols: list, t = None, x = None):
+    """
+    The (t, x) grid the solutions are compared on. Defaults to the times and positions of the coarsest solution
+    inside the range every solution covers, so nothing is extrapolated
+    """
+    if t is None:
+        t = _coarsest([np.asarray(sol.data_full["t"]) for sol in sols])
+    if x is None:
+        x = _coarsest([np.asarray(sol.data_full["x"]) for sol in sols])
+    return np.asarray(t, dtype=float), np.asarray(x, dtype=float)
+
+
+def interpolation_operator(source, target):
+    """
+    Linear interpolation from the points source onto the points target, as (indices, weights) so that
+    values[indices]*(1-weights) + values[indices+1]*weights gives the interpolated values. Cached, since runs of a sweep share their grids
+    """
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    key = (_digest(source), _digest(target))
+    if key not in _OPERATOR_CACHE:
+        if len(source) == 1:
+            indices, weights = np.zeros(len(target), dtype=int), np.zeros(len(target))
+        else:
+            indices = np.clip(np.searchsorted(source, target, side="right") - 1, 0, len(source)-2)
+            weights = np.clip((target - source[indices])/(source[indices+1] - source[indices]), 0, 1)
+        _OPERATOR_CACHE[key] = (indices, weights)
+    return _OPERATOR_CACHE[key]
+
+
+def interpolate(sol, fields: list, t, x):
+    """
+    Every field of a solution on the grid (t, x), as one array of shape (fields, t, x).
+    Only the output times next to the times of t are read
+    """
+    t_idx, t_w = interpolation_operator(sol.data_full["t"], t)
+    x_idx, x_w = interpolation_operator(sol.data_full["x"], x)
+
+    rows = np.unique(np.concatenate([t_idx, np.minimum(t_idx+1, len(sol.data_full["t"])-1)]))
+    position = np.searchsorted(rows, t_idx)
+    position_next = np.searchsorted(rows, np.minimum(t_idx+1, len(sol.data_full["t"])-1))
+
+    stacked = np.stack([np.asarray(sol.data_full[key][rows], dtype=float) for key in fields])
+    in_time = stacked[:, position]*(1 - t_w[:, None]) + stacked[:, position_next]*t_w[:, None]
+    return in_time[..., x_idx]*(1 - x_w) + in_time[..., np.minimum(x_idx+1, stacked.shape[-1]-1)]*x_w
+
+
+def compare_runs(sols: list, fields: list = None, reference: int = 0, t = None, x = None, relative: bool = False, labels: list = None):
+    """
+    Compares two or more solutions, also with different grid.Nx or output times, on a common (t, x) grid.
+    Every solution is interpolated once and the errors of every field, time and solution are computed in one batched pass.
+
+    sols:      List of SolutionClass objects (or anything with data_full)
+    fields:    Keys of data_full to compare. Defaults to DEFAULT_FIELDS
+    reference: Index of the solution the others are compared with
+    t, x:      Common grid. Defaults to common_grid
+    relative:  Whether the errors are divided by the same norm of the reference
+    labels:    Names of the solutions in the report. Defaults to data_full["label"], numbered if not unique
+
+    Returns dict with
+        "t", "x":   the common grid
+        "fields":   the compared fields
+        "labels":   the labels of the compared solutions (every solution but the reference)
+        "errors":   array of shape (solutions, fields, norms, t) with the L1, L2 and Linf errors over x at every time.
+                    L1 and L2 are integrals over x
+        "summary":  dict {label: {field: {norm: largest error over time}}}
+    """
+    if len(sols) < 2:
+        raise ValueError("At least two solutions are needed for a comparison")
+    if fields is None:
+        fields = [key for key in DEFAULT_FIELDS if all(key in sol.data_full for sol in sols)]
+    if labels is None:
+        labels = [sol.data_full["label"] if "label" in sol.data_full else str(i) for i, sol in enumerate(sols)]
+        if len(set(labels)) < len(labels):
+            labels = [f"{label} ({i})" for i, label in enumerate(labels)]
+
+    t, x = common_grid(sols, t, x)
+    weights = _trapezoid_weights(x)
+
+    ref = interpolate(sols[reference], fields, t, x)
+    others = [i for i in range(len(sols)) if i != reference]
+    difference = np.abs(np.stack([interpolate(sols[i], fields, t, x) for i in others]) - ref)
+
+    errors = np.stack([difference @ weights, np.sqrt(difference**2 @ weights), difference.max(axis=-1)], axis=2)
+    if relative:
+        scale = np.stack([np.abs(ref) @ weights, np.sqrt(ref**2 @ weights), np.abs(ref).max(axis=-1)], axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            errors = np.where(scale > 0, errors/scale, errors)
+
+    other_labels = [labels[i] for i in others]
+    summary = {label: {key: {norm: float(np.max(errors[s, f, n])) for n, norm in enumerate(NORMS)}
+                       for f, key in enumerate(fields)}
+               for s, label in enumerate(other_labels)}
+
+    return {"t": t, "x": x, "fields": list(fields), "labels": other_labels, "reference": labels[reference],
+            "errors": errors, "summary": summary}
+
+
+def print_report(report: dict, norm: str = "L2"):
+    """
+    Prints the largest error over time of every field and solution of a compare_runs report
+    """
+    print("Compared with '{}' on {} times and {} points. Largest {} error over time:".format(report["reference"], len(report["t"]), len(report["x"]), norm))
+    print("{:>20} ".format("") + " ".join("{:>10}".format(key) for key in report["fields"]))
+    for label, fields in report["summary"].items():
+        print("{:>20} ".format(str(label)[:20]) + " ".join("{:10.3e}".format(fields[key][norm]) for key in report["fields"]))
+
+
+def clear_cache():
+    """
+    Forgets every cached interpolation operator
+    """
+    _OPERATOR_CACHE.clear()
+
+
+####################
+# Helper functions #
+####################
+def _coarsest(grids: list):
+    """
+    The grid with the fewest points, restricted to the range every grid covers
+    """
+    low  = max(grid[0]  for grid in grids)
+    high = min(grid[-1] for grid in grids)
+    if low > high:
+        raise ValueError(f"The solutions do not overlap. Common range is [{low}, {high}]")
+    grid = min(grids, key=len)
+    return grid[(grid >= low) & (grid <= high)]
+
+
+def _digest(arr):
+    return hashlib.sha1(str(arr.shape).encode() + np.ascontiguousarray(arr).tobytes()).hexdigest()
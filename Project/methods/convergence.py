@@ -0,0 +1,110 @@
+import copy
+import numpy as np
+from methods.SolutionClass2 import SolutionClass
+
+
+def grid_convergence(params: dict, fields = ("ni", "ne"), Nx_start: int = None, refinement: int = 2, Nx_max: int = 4096,
+                     tol: float = 1e-3, norm: str = "L2", time_index = -1,
+                     solutions: dict = None,
+                     two_fluid_file = "../temp_plasma",
+                     report: bool = True,
+                    ):
+    """
+    Grid convergence study: refines grid.Nx step by step until the observed error is below tol.
+    Every run is restricted (linearly interpolated) to the grid of the coarsest run, and compared with the run before it.
+    The difference between two successive resolutions is used as the error of the coarser one,
+    and the observed convergence order is p = log(e_old/e_new)/log(refinement).
+
+    Returns a dict with
+        "Nx":        the cheapest Nx with an observed error below tol, or None if Nx_max was reached first
+        "history":   list with the errors (L1, L2 and Linf relative norms for every field) and orders of every refinement step
+        "solutions": dict {Nx: SolutionClass} of every run
+
+    fields:     Fields compared between the resolutions
+    Nx_start:   Coarsest resolution. Defaults to params["grid"]["Nx"]
+    refinement: Factor Nx is multiplied with in every step
+    tol:        Largest accepted relative error (largest over the fields)
+    norm:       'L1', 'L2' or 'Linf'. The norm used for tol
+    time_index: Output time compared. None compares every output time
+    solutions:  dict {Nx: SolutionClass} of runs that are already done, e.g. the "solutions" of an earlier call. These are not run again.
+                Runs are also reused through the simulation cache (see methods/cache.py)
+    """
+
+    if norm not in ("L1", "L2", "Linf"):
+        raise ValueError(f"norm should be either 'L1', 'L2' or 'Linf'. Was '{norm}'")
+    if Nx_start is None:
+        Nx_start = params["grid"]["Nx"]
+    if solutions is None:
+        solutions = {}
+
+    def solve(Nx):
+        if Nx not in solutions:
+            if report: print(f"Running Nx = {Nx}")
+            run_params = copy.deepcopy(params)
+            run_params["grid"]["Nx"] = Nx
+            solutions[Nx] = SolutionClass(run_params, two_fluid_file=two_fluid_file)
+        return solutions[Nx]
+
+    coarse = solve(Nx_start)
+    x_coarse = np.asarray(coarse.data_full["x"])
+    previous = {key: _restrict(coarse, key, x_coarse, time_index) for key in fields}
+
+    history = []
+    result  = {"Nx": None, "history": history, "solutions": solutions}
+    Nx = Nx_start
+    while Nx*refinement <= Nx_max:
+        Nx_fine = Nx*refinement
+        current = {key: _restrict(solve(Nx_fine), key, x_coarse, time_index) for key in fields}
+
+        step = {"Nx": Nx, "Nx_fine": Nx_fine, "errors": {}, "order": {}}
+        for key in fields:
+            step["errors"][key] = _error_norms(previous[key], current[key])
+            if history and history[-1]["errors"][key][norm] > 0 and step["errors"][key][norm] > 0:
+                step["order"][key] = np.log(history[-1]["errors"][key][norm] / step["errors"][key][norm]) / np.log(refinement)
+            else:
+                step["order"][key] = np.nan
+        step["error"] = max(step["errors"][key][norm] for key in fields)
+        history.append(step)
+
+        if report:
+            print("Nx = {} vs {}: error {:.3e}, order {}".format(Nx, Nx_fine, step["error"], {key: round(float(p), 2) for key, p in step["order"].items()}))
+
+        if step["error"] <= tol:
+            result["Nx"] = Nx
+            break
+
+        previous = current
+        Nx = Nx_fine
+
+    return result
+
+
+####################
+# Helper functions #
+####################
+def _restrict(sol, key: str, x_coarse, time_index = -1):
+    """
+    Linearly interpolates a field of a solution onto the coarse grid x_coarse
+    time_index: Output time to use. None for every output time
+    """
+    x = np.asarray(sol.data_full["x"])
+    field = sol.data_full[key] if time_index is None else sol.data_full[key][time_index]
+    field = np.asarray(field)
+
+    if field.ndim == 1:
+        return np.interp(x_coarse, x, field)
+    return np.array([np.interp(x_coarse, x, row) for row in field])
+
+
+def _error_norms(arr, ref):
+    """
+    Relative L1, L2 and Linf norms of the difference between an array and a reference
+    """
+    diff = np.abs(np.asarray(arr) - np.asarray(ref)).ravel()
+    ref  = np.abs(np.asarray(ref)).ravel()
+
+    norms = {}
+    for name, func in (("L1", lambda a: np.sum(a)), ("L2", lambda a: np.sqrt(np.sum(a**2))), ("Linf", np.max)):
+        scale = func(ref)
+        norms[name] = float(func(diff) / scale) if scale > 0 else float(func(diff))
+    return norms
@@ -1,4 +1,111 @@
+import time
 import numpy as np
+from collections.abc import MutableMapping
+
+# Fields iterated by iter_data if nothing else is asked for
+DEFAULT_FIELDS = ["ne", "ue", "Te", "ni", "ui", "Ti", "charge", "potential", "electric"]
+
+# Names of the netCDF variables behind the time dependent entries of the data dicts
+NC_NAMES = {
+    "t"         : "time",
+    "nsteps"    : "nsteps",
+    "nfailed"   : "failed",
+    "duration"  : "duration",
+    "ne"        : "electrons",
+    "ue"        : "ue",
+    "Te"        : "te",
+    "ni"        : "ions",
+    "ui"        : "ui",
+    "Ti"        : "ti",
+    "potential" : "potential",
+}
+
+# Registry of derived quantities, computed from other entries of the data the first time they are used.
+# {key: (keys computed together, keys they depend on, function)}. See register_derived
+DERIVED = {}
+
+
+class LazyData(MutableMapping):
+    """
+    Dict of simulation data where every entry is only computed the first time it is accessed and then kept.
+    Behaves like a normal dict otherwise. Entries can be overwritten or added manually.
+
+    loaders: dict with a function without arguments for every key, which computes the entry
+
+    self.load_seconds: Wall time spent computing every loaded entry, including the entries it depends on
+    """
+
+    def __init__(self, loaders: dict = None):
+        self._loaders = {} if loaders is None else dict(loaders)
+        self._store   = {}
+        self._depends = {}
+        self.load_seconds = {}
+
+    def __getitem__(self, key):
+        if key not in self._store:
+            if key not in self._loaders:
+                raise KeyError(key)
+            start = time.perf_counter()
+            self._store[key] = self._loaders[key]()
+            self.load_seconds[key] = time.perf_counter() - start
+        return self._store[key]
+
+    def __setitem__(self, key, value):
+        self._store[key] = value
+
+    def __delitem__(self, key):
+        if key not in self._store and key not in self._loaders:
+            raise KeyError(key)
+        self._store.pop(key, None)
+        self._loaders.pop(key, None)
+
+    def __contains__(self, key):
+        # Without this, Mapping checks for a key by loading it
+        return key in self._loaders or key in self._store
+
+    def __iter__(self):
+        yield from self._loaders
+        yield from (key for key in self._store if key not in self._loaders)
+
+    def __len__(self):
+        return len(self._loaders.keys() | self._store.keys())
+
+    def __repr__(self):
+        return "LazyData(loaded={}, keys={})".format(list(self._store), list(self))
+
+    def __reduce__(self):
+        # Pickles as a plain dict with everything loaded, since the loaders usually hold an open file
+        return (dict, (dict(self),))
+
+    def is_loaded(self, key):
+        """
+        Whether the entry has already been computed
+        """
+        return key in self._store
+
+    def load(self, derived: bool = True):
+        """
+        Computes every entry that has not been accessed yet
+        derived: Whether the derived entries are computed too. Without them only the entries read from the source are loaded
+        """
+        for key in self:
+            if derived or key not in self._depends:
+                self[key]
+        return self
+
+    def invalidate(self, key: str = None):
+        """
+        Forgets the computed value of an entry and of every derived entry depending on it, so they are computed again when next used.
+        Without a key every entry that can be computed again is forgotten. Entries without a loader are kept
+        """
+        keys = set(self._loaders) if key is None else {key}
+        while keys:
+            key = keys.pop()
+            if key in self._loaders:
+                self._store.pop(key, None)
+                self.load_seconds.pop(key, None)
+            keys |= {other for other, depends in self._depends.items() if key in depends and self.is_loaded(other)}
+
 
 def extract_data(var, params: dict, only_last: bool=True):
     """
@@ -8,127 +115,274 @@ def extract_data(var, params: dict, only_last: bool=True):
     only_last: Whether to return just the data for just the final time. Else the complete set for every point in time and space is returned
     """
 
+    data, data_full = extract_views(var, params)
+
+    return dict(data) if only_last else dict(data_full)
+
+
+def extract_views(var, params: dict):
+    """
+    Makes lazy views of the data from the temp-two-fluid simulation. Every variable is only read from the file when it is first used.
+    Returns (data, data_full) with the same entries as extract_data with only_last True and False.
+    The final time view is sliced from the full view for every entry that the full view has already loaded.
+    The netCDF file has to stay open for as long as entries may still be loaded.
+    var: netCDF4 Dataset.variables
+    params: dictionary of parameters for simulation
+    """
+
+    last_idx = var["time"].shape[0]-1
+
+    data_full = LazyData()
+    data_full._loaders = _make_loaders(data_full, _reader(var, slice(None)), var, params, last_idx, only_last=False)
+    add_derived(data_full, params)
+
+    data = time_view(var, params, last_idx, data_full=data_full)
+    data._loaders["x"] = lambda: data_full["x"]
+
+    return data, data_full
+
+
+def time_view(var, params: dict, index, data_full=None):
+    """
+    Makes a lazy view of the data for only some of the times, read directly from the netCDF file
+    var: netCDF4 Dataset.variables
+    params: dictionary of parameters for simulation
+    index: Time index (gives the same entries as extract_data with only_last=True) or slice of time indices
+    data_full: Optional lazy view of the full data. Entries it has already loaded are sliced instead of read again
+    """
+
     last_idx = var["time"].shape[0]-1
 
-    if params["physical"]["type"] == "adiabatic":
-        electrons = np.exp( var["potential"][:,:])
+    data = LazyData()
+    data._loaders = _make_loaders(data, _reader(var, index, data_full), var, params, last_idx, only_last=not isinstance(index, slice))
+    add_derived(data, params)
+
+    return data
+
+
+def register_derived(keys, depends, func = None):
+    """
+    Registers a quantity computed from other entries of the data. It is added to every data view made afterwards
+    (simulation output and saved runs) and is only computed the first time it is used.
+    keys:    Key of the quantity, or tuple of keys computed together by a single call
+    depends: Keys of the entries the quantity is computed from, raw netCDF entries (see NC_NAMES) or other derived quantities
+    func:    Function taking params followed by the values of depends. Returns the quantity, or a dict {key: value} for several keys.
+             Should work both for a single time (fields of shape (x,)) and for every time (shape (time, x))
+    Can be used as a decorator:
+        @register_derived("pressure_e", ("ne", "Te"))
+        def pressure_e(params, ne, Te):
+            return ne*Te
+    """
+    if func is None:
+        return lambda func: register_derived(keys, depends, func)
+
+    keys = (keys,) if isinstance(keys, str) else tuple(keys)
+    for key in keys:
+        DERIVED[key] = (keys, tuple(depends), func)
+    return func
+
+
+def add_derived(data: LazyData, params: dict):
+    """
+    Adds loaders for every registered derived quantity that data does not have yet and whose dependencies are available
+    """
+    added = True
+    while added:
+        added = False
+        for key, (keys, depends, func) in DERIVED.items():
+            if key in data or not all(dep in data for dep in depends):
+                continue
+            data._loaders[key] = _derived_loader(data, params, key, keys, depends, func)
+            data._depends[key] = depends
+            added = True
+    return data
+
+
+def iter_data(source, params: dict, fields: list = None, chunk_size: int = None, start: int = 0, stop: int = None, step: int = 1):
+    """
+    Goes through the simulation data in time, so that only a chunk of the time steps has to be in memory at once.
+    Yields dicts with 'time_idx', 't', 'x' and the requested fields. Derived fields (charge, electric, norms, ...) are only computed for the chunk.
+    source:     netCDF4 Dataset.variables of the simulation output, or a data_full dict (e.g. memory-mapped by load_data)
+    params:     dictionary of parameters for simulation
+    fields:     Keys of the data to include. Defaults to DEFAULT_FIELDS
+    chunk_size: Number of time steps in each chunk. The fields then have the shape (time, x).
+                If None, single times are given with the same shapes as SolutionClass.data
+    start, stop, step: Range of time indices to go through, as for slicing. step has to be positive
+    """
+
+    if step is None: step = 1
+    if step < 1:
+        raise ValueError(f"step has to be positive, got {step}")
+    if fields is None:
+        fields = DEFAULT_FIELDS
+
+    from_file = "time" in source
+    n_t = source["time"].shape[0] if from_file else len(source["t"])
+    indices = range(*slice(start, stop, step).indices(n_t))
+
+    if chunk_size is None:
+        index_list = list(indices)
     else:
-        electrons = var["electrons"][:,:]
+        index_list = [slice(indices[i], indices[min(i+chunk_size, len(indices))-1]+1, indices.step) for i in range(0, len(indices), chunk_size)]
+
+    x = np.array(np.ma.getdata(source["x"][:]))
+    for index in index_list:
+        if from_file:
+            view = time_view(source, params, index)
+        else:
+            view = LazyData({key: (lambda key=key: source[key][index]) for key in ["t"] + list(fields) + list(NC_NAMES) if key in source})
+            view["x"] = x
+            add_derived(view, params)
+        view["x"] = x
+
+        chunk = {"time_idx": np.arange(*index.indices(n_t)) if isinstance(index, slice) else index, "t": view["t"], "x": x}
+        for key in fields:
+            chunk[key] = view[key]
+
+        yield chunk
 
-    # Prepares fields
-    charge    = np.ma.getdata(var["ions"][:,:]) - np.ma.getdata(electrons[:,:])
-    potential = np.ma.getdata(var["potential"][:,:])
-    electric  = -np.gradient(np.ma.getdata(var["potential"][:,:]), np.ma.getdata(var['x'][:]), axis=1)
 
-    # Prepares labels too
+####################
+# Helper functions #
+####################
+def _make_label(params: dict):
+    """
+    Prepares the label of the simulation for plots
+    """
     label = f"{params['advection']['type']}"
     if "variant" in params["advection"].keys():
-        if (params['advection']['variant'] == "original"): 
+        if (params['advection']['variant'] == "original"):
             label += " semi-implicit"
-        else: 
+        else:
             label += f" {params['advection']['variant']}"
+    return label
 
-    # For old system without temperature fields
-    try:
-        Te = var["te"]
-        Ti = var["ti"]
-    except:
-        print("Error: No temperature fields found. Setting to constant")
-        Te = Ti = params["physical"]["tau"]*np.ones(electrons.shape)
+
+def _reader(var, index, data_full=None):
+    """
+    Makes a function reading the time series of an entry from the file at the time indices 'index'
+    """
+    def read(key):
+        if data_full is not None and data_full.is_loaded(key):
+            return data_full[key][index]
+        return np.ma.getdata(var[NC_NAMES[key]][index])
+    return read
+
+
+def _make_loaders(data, read, var, params: dict, last_idx: int, only_last: bool):
+    """
+    Makes the functions reading every raw entry of a data view. Derived quantities are added with add_derived
+    data: The view itself, used by entries that depend on others
+    read: Function reading the time series (or single time) of an entry from the file
+    only_last: Whether the view is for a single time
+    """
+
+    label = _make_label(params)
 
     if only_last:
+        as_int   = int
+        as_float = float
+    else:
+        as_int   = lambda arr: np.array(arr, dtype=int)
+        as_float = np.array
+
+    def electrons():
+        if params["physical"]["type"] == "adiabatic":
+            return np.exp(data["potential"])
+        return read("ne")
+
+    def temperature(key):
+        # For old system without temperature fields
+        if NC_NAMES[key] in var:
+            return read(key)
+        print("Error: No temperature fields found. Setting to constant")
+        return params["physical"]["tau"]*np.ones(data["ne"].shape)
+
+    return {
+        # metadata
+        "label"    : lambda: label,
+        "last_idx" : lambda: last_idx,
+        "nsteps"   : lambda: as_int(read("nsteps")),
+        "nfailed"  : lambda: as_int(read("nfailed")),
+        "duration" : lambda: as_float(read("duration")),
+
+        # Time and space
+        "t"       : lambda: as_float(read("t")),
+        "x"       : lambda: np.array(np.ma.getdata(var['x'][:])),
+
+        # Electrons
+        "ne"      : electrons,
+        "ue"      : lambda: read("ue"),
+        "Te"      : lambda: temperature("Te"),
+
+        # Ions
+        "ni"      : lambda: read("ni"),
+        "ui"      : lambda: read("ui"),
+        "Ti"      : lambda: temperature("Ti"),
+
+        # Fields. Derived quantities are added from DERIVED by the views
+        "potential" : lambda: read("potential"),
+    }
+
+
+def _derived_loader(data: LazyData, params: dict, key: str, keys: tuple, depends: tuple, func):
+    """
+    Makes the function computing a derived quantity. Quantities computed together are all stored by the first call
+    """
+    def load():
+        value = func(params, *(data[dep] for dep in depends))
+        if len(keys) == 1:
+            return value
+        for other in keys:
+            if other != key and other in data._loaders and not data.is_loaded(other):
+                data[other] = value[other]
+        return value[key]
+    return load
+
+
+def _trapezoid_weights(x):
+    """
+    Weights w such that w @ f is the trapezoidal integral of f over x. Also for unequally spaced x
+    """
+    x = np.asarray(x, dtype=float)
+    weights = np.zeros(len(x))
+    if len(x) < 2:
+        return weights
+    dx = np.diff(x)
+    weights[:-1] += dx/2
+    weights[1:]  += dx/2
+    return weights
+
+
+def _conservation_integrals(params: dict, x, ne, ue, Te, ni, ui, Ti, electric):
+    """
+    Total mass, momentum and energy of electrons and ions, and the energy of the electric field, at every time.
+    Masses are in units of the ion mass, so the electron mass is |mu|. The energy of a species is its kinetic energy
+    m n u^2/2 plus its thermal energy n T/2 (one degree of freedom). The field energy is epsilon_D E^2/2.
+    Every integral is a product with the trapezoidal weights of x, for all times at once.
+    """
+    weights = _trapezoid_weights(x)
+    mass = {"e": abs(params["physical"]["mu"]), "i": 1.0}
+
+    totals = {}
+    for species, n, u, T in (("e", ne, ue, Te), ("i", ni, ui, Ti)):
+        m = mass[species]
+        nu = n*u
+        totals["m_" + species] = m*(n @ weights)
+        totals["p_" + species] = m*(nu @ weights)
+        totals["E_" + species] = (0.5*m*nu*u + 0.5*n*T) @ weights
+    totals["E_field"] = 0.5*params["physical"]["epsilon_D"]*(electric**2 @ weights)
+    return totals
+
+
+######################
+# Derived quantities #
+######################
+register_derived("charge",   ("ni", "ne"),       lambda params, ni, ne: ni - ne)
+register_derived("electric", ("potential", "x"), lambda params, potential, x: -np.gradient(potential, x, axis=-1))
+
+for _key in ("ne", "ue", "Te", "ni", "ui", "Ti", "charge", "potential", "electric"):
+    register_derived("norm_" + _key, (_key,), lambda params, field: np.linalg.norm(field, ord=1, axis=-1))
 
-        data = {
-            # metadata
-            "label"    : label,
-            "last_idx" : last_idx,
-            "nsteps"   : int(np.ma.getdata(var["nsteps"][last_idx])),
-            "nfailed"  : int(np.ma.getdata(var["failed"][last_idx])),
-            "duration" : float(np.ma.getdata(var["duration"][last_idx])),
-
-            # Time and space
-            "t"       : float(np.ma.getdata(var["time"][last_idx])),
-            "x"       : np.ma.getdata(var['x'][:]),
-
-            # Electrons
-            "ne"      : np.ma.getdata(electrons[last_idx,:]),
-            "ue"      : np.ma.getdata(var["ue"][last_idx,:]),
-            "Te"      : np.ma.getdata(Te[last_idx,:]),
-            "norm_ne" : np.linalg.norm( electrons, ord=1), # type: ignore
-            "norm_ue" : np.linalg.norm( var["ue"][last_idx,:], ord=1), # type: ignore
-            "norm_Te" : np.linalg.norm( Te[last_idx,:], ord=1), # type: ignore
-
-            # Ions
-            "ni"      : np.ma.getdata(var["ions"][last_idx,:]),
-            "ui"      : np.ma.getdata(var["ui"][last_idx,:]),
-            "Ti"      : np.ma.getdata(Ti[last_idx,:]),
-            "norm_ni" : np.linalg.norm( var["ions"][last_idx,:], ord=1), # type: ignore
-            "norm_ui" : np.linalg.norm( var["ui"][last_idx,:], ord=1), # type: ignore
-            "norm_Ti" : np.linalg.norm( Ti[last_idx,:], ord=1), # type: ignore
-
-            # Fields
-            "charge"         : charge[last_idx,:],
-            "potential"      : potential[last_idx,:],
-            "electric"       : electric[last_idx,:],
-            "norm_charge"    : np.linalg.norm( charge[last_idx,:], ord=1),
-            "norm_potential" : np.linalg.norm( potential[last_idx,:], ord=1),
-            "norm_electric"  : np.linalg.norm( electric[last_idx,:], ord=1),
-
-            #"m"      : total_mass,
-            #"p"      : total_momentum,
-            #"E"      : total_energy,
-        }
-    
-    
-    else:  # Data for every saved timestep
-
-        data = {
-            # metadata
-            "label"    : label,
-            "last_idx" : last_idx,
-            "nsteps"   : np.array(np.ma.getdata(var["nsteps"][:]), dtype=int),
-            "nfailed"  : np.array(np.ma.getdata(var["failed"][:]), dtype=int),
-            "duration" : np.ma.getdata(var["duration"][:]),
-
-            # Time and space
-            "t"       : np.array(np.ma.getdata(var["time"][:])),
-            "x"       : np.array(np.ma.getdata(var['x'][:])),
-
-            # Electrons
-            "ne"      : np.ma.getdata(electrons[:,:]),
-            "ue"      : np.ma.getdata(var["ue"][:,:]),
-            "Te"      : np.ma.getdata(Te[:,:]),
-            "norm_ne" : np.linalg.norm( electrons, ord=1, axis=1), # type: ignore
-            "norm_ue" : np.linalg.norm( var["ue"][:,:], ord=1, axis=1), # type: ignore
-            "norm_Te" : np.linalg.norm( Te[:,:], ord=1, axis=1), # type: ignore
-
-            # Ions
-            "ni"      : np.ma.getdata(var["ions"][:,:]),
-            "ui"      : np.ma.getdata(var["ui"][:,:]),
-            "Ti"      : np.ma.getdata(Ti[:,:]),
-            "norm_ni" : np.linalg.norm( var["ions"][:,:], ord=1, axis=1), # type: ignore
-            "norm_ui" : np.linalg.norm( var["ui"][:,:], ord=1, axis=1), # type: ignore
-            "norm_Ti" : np.linalg.norm( Ti[:,:], ord=1, axis=1), # type: ignore
-
-            # Fields
-            "charge"         : charge,
-            "potential"      : potential,
-            "electric"       : electric,
-            "norm_charge"    : np.linalg.norm( charge, ord=1, axis=1),
-            "norm_potential" : np.linalg.norm( potential, ord=1, axis=1),
-            "norm_electric"  : np.linalg.norm( electric, ord=1, axis=1),
-
-
-            #"m"      : total_mass,
-            #"p"      : total_momentum,
-            #"E"      : total_energy,
-        }
-
-        #data["Te"] = np.where(np.isnan(data["Te"]), 0.0, data["Te"])
-        #data["norm_Te"] = np.where(np.isnan(data["norm_Te"]), 0.0, data["norm_Te"])
-
-        #print(data["Te"])
-        #print(data["norm_Te"])
-            
-
-    return data
\ No newline at end of file
+register_derived(("m_e", "p_e", "E_e", "m_i", "p_i", "E_i", "E_field"),
+                 ("x", "ne", "ue", "Te", "ni", "ui", "Ti", "electric"), _conservation_integrals)
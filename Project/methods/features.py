@@ -0,0 +1,165 @@
+import numpy as np
+
+
+def extract_features(profiles, x, flat_tol: float = 0.05, min_width: float = None, max_plateaus: int = 4, smooth: int = 1):
+    """
+    Finds the plateaus, the shock (steepest jump), the front position and the levels on both sides of the shock
+    in many profiles at once, e.g. ni at chosen times for every run of a stacked sweep.
+    Profiles containing nan (e.g. missing runs of a sweep) give nan.
+
+    profiles:     Array of shape (..., x)
+    x:            Grid positions, shape (x,)
+    flat_tol:     A point belongs to a plateau where |d profile/dx| is below flat_tol times the range of the profile divided by the length of the grid
+    min_width:    Shortest plateau. Defaults to 2% of the grid
+    max_plateaus: Number of plateaus kept per profile, from left to right
+    smooth:       Width in points of a moving average applied before the gradient, against oscillations at the shock. 1 for none
+
+    Returns dict of arrays with the leading shape of profiles:
+        "plateau_levels", "plateau_start", "plateau_end": mean level and x range of every plateau, with a last axis of length
+                                                          max_plateaus padded with nan
+        "n_plateaus":   number of plateaus found (may be larger than max_plateaus)
+        "shock":        x of the steepest point
+        "front":        x where the profile crosses the middle between the levels behind and ahead of the shock, nearest to the shock
+        "level_behind": level of the last plateau to the left of the shock (the shock height for a front moving right)
+        "level_ahead":  level of the first plateau to the right of the shock
+        "jump":         level_behind - level_ahead
+    """
+
+    profiles = np.asarray(profiles, dtype=float)
+    x = np.asarray(x, dtype=float)
+    shape = profiles.shape[:-1]
+    data = profiles.reshape(-1, profiles.shape[-1])
+    n_profiles, n_x = data.shape
+    length = x[-1] - x[0]
+    if min_width is None:
+        min_width = 0.02*length
+
+    smoothed = _moving_average(data, smooth)
+    gradient = np.gradient(smoothed, x, axis=-1)
+    valid = np.all(np.isfinite(data), axis=-1)
+
+    # Plateaus: runs of points with a small gradient
+    with np.errstate(invalid="ignore"):
+        scale = (np.max(data, axis=-1, initial=-np.inf) - np.min(data, axis=-1, initial=np.inf))/length
+        flat = (np.abs(gradient) <= flat_tol*scale[:, None]) & valid[:, None]
+    plateaus = _plateaus(data, x, flat, min_width, max_plateaus)
+
+    # Shock: steepest point
+    steepest = np.argmax(np.where(np.isfinite(gradient), np.abs(gradient), -np.inf), axis=-1)
+    shock = np.where(valid, x[steepest], np.nan)
+
+    # Plateaus on each side of the shock
+    levels, starts, ends = plateaus["plateau_levels"], plateaus["plateau_start"], plateaus["plateau_end"]
+    with np.errstate(invalid="ignore"):
+        behind = ends <= shock[:, None]
+        ahead  = starts >= shock[:, None]
+    k_behind = max_plateaus-1 - np.argmax(behind[:, ::-1], axis=-1)
+    k_ahead  = np.argmax(ahead, axis=-1)
+    rows = np.arange(n_profiles)
+    level_behind = np.where(behind.any(axis=-1), levels[rows, k_behind], np.nan) if max_plateaus > 0 else np.full(n_profiles, np.nan)
+    level_ahead  = np.where(ahead.any(axis=-1),  levels[rows, k_ahead],  np.nan) if max_plateaus > 0 else np.full(n_profiles, np.nan)
+
+    # Without plateaus on a side, the profile value at that end is used for the middle level
+    middle = (np.where(np.isfinite(level_behind), level_behind, data[:, 0]) + np.where(np.isfinite(level_ahead), level_ahead, data[:, -1]))/2
+    front = _nearest_crossing(data, x, middle, steepest)
+
+    features = dict(plateaus)
+    features.update({
+        "shock"        : shock,
+        "front"        : np.where(valid, front, np.nan),
+        "level_behind" : level_behind,
+        "level_ahead"  : level_ahead,
+        "jump"         : level_behind - level_ahead,
+    })
+    return {key: value.reshape(shape + value.shape[1:]) for key, value in features.items()}
+
+
+def sweep_features(sweep, key: str = "ni", time_index = -1, **kwargs):
+    """
+    extract_features for a field of every run of a SweepDataset at the chosen times, in one pass.
+    Every feature has the parameter axes of the sweep first, then the time axis if time_index selects several times.
+
+    time_index: Index, slice or list of time indices
+    **kwargs:   Settings of extract_features
+
+    Example (the shock heights of Ion_Velocity 3):
+        sweep = SweepDataset.from_glob("DATA/Shock-shape/*", {"nrel": lambda i: i["n_r"]/i["n_l"], "trel": lambda i: i["t_r"]/i["t_l"],
+                                                               "namp": lambda i: i["n_l"], "Tamp": lambda i: i["t_l"]})
+        heights = sweep_features(sweep, "ni", time_index=40)["level_behind"]   # shape (4, 4, 4, 4)
+    """
+    if isinstance(time_index, list):
+        time_index = np.asarray(time_index)
+    return extract_features(sweep.stack(key, time_index=time_index), sweep.x, **kwargs)
+
+
+####################
+# Helper functions #
+####################
+def _moving_average(data, width: int):
+    """
+    Centered moving average over the last axis. The ends are averaged over the points available
+    """
+    if width <= 1:
+        return data
+    cumsum = np.cumsum(np.pad(data, ((0, 0), (1, 0))), axis=-1)
+    n_x = data.shape[-1]
+    low  = np.clip(np.arange(n_x) - width//2, 0, n_x)
+    high = np.clip(np.arange(n_x) + (width - width//2), 0, n_x)
+    return (cumsum[:, high] - cumsum[:, low])/(high - low)
+
+
+def _plateaus(data, x, flat, min_width: float, max_plateaus: int):
+    """
+    Mean level and x range of the runs of flat points of every profile, at least min_width wide, at most max_plateaus per profile
+    """
+    n_profiles, n_x = data.shape
+
+    # Every run of flat points gets its own number, counted over all profiles
+    padded = np.pad(flat, ((0, 0), (1, 1)))
+    first  = padded[:, 1:-1] & ~padded[:, :-2]
+    last   = padded[:, 1:-1] & ~padded[:, 2:]
+    segment = np.cumsum(first.ravel()) - 1
+
+    profile_of = np.nonzero(first)[0]
+    start = x[np.nonzero(first)[1]]
+    end   = x[np.nonzero(last)[1]]
+    mask  = flat.ravel()
+    n_segments = len(start)
+    count = np.bincount(segment[mask], minlength=n_segments)
+    total = np.bincount(segment[mask], weights=data.ravel()[mask], minlength=n_segments)
+    level = total/np.maximum(count, 1)
+
+    keep = end - start >= min_width
+    profile_of, start, end, level = profile_of[keep], start[keep], end[keep], level[keep]
+
+    # Position of every plateau among the plateaus of its profile
+    group_start = np.searchsorted(profile_of, profile_of, side="left")
+    rank = np.arange(len(profile_of)) - group_start
+    fits = rank < max_plateaus
+
+    result = {name: np.full((n_profiles, max_plateaus), np.nan) for name in ("plateau_levels", "plateau_start", "plateau_end")}
+    result["plateau_levels"][profile_of[fits], rank[fits]] = level[fits]
+    result["plateau_start"][profile_of[fits], rank[fits]]  = start[fits]
+    result["plateau_end"][profile_of[fits], rank[fits]]    = end[fits]
+    result["n_plateaus"] = np.bincount(profile_of, minlength=n_profiles)
+    return result
+
+
+def _nearest_crossing(data, x, level, index):
+    """
+    Linearly interpolated x where every profile crosses its level, taking the crossing nearest to the given index
+    """
+    with np.errstate(invalid="ignore"):
+        sign = np.sign(data - level[:, None])
+    crossings = np.abs(np.diff(sign, axis=-1)) > 0
+    crossings &= (sign[:, :-1] != 0) | (sign[:, 1:] == 0)   # touching the level counts once
+
+    distance = np.where(crossings, np.abs(np.arange(data.shape[-1]-1)[None, :] - index[:, None]), np.iinfo(int).max)
+    j = np.argmin(distance, axis=-1)
+    found = crossings.any(axis=-1)
+
+    rows = np.arange(len(data))
+    y0, y1 = data[rows, j], data[rows, j+1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(y1 != y0, (level - y0)/(y1 - y0), 0.0)
+    return np.where(found, x[j] + fraction*(x[j+1] - x[j]), np.nan)
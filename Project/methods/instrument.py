@@ -0,0 +1,205 @@
+import os
+import json
+import glob
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+
+class Instrumentation:
+    """
+    Records the wall time and memory use of every stage of a simulation, plus counters reported by the simulator.
+
+    self.stages:   List of dicts with the name, wall time and memory of every recorded stage, in order. Memory is in MB (1e6 bytes):
+                   "rss_mb":              resident memory of this process at the end of the stage
+                   "max_rss_mb":          largest resident memory of this process during the stage. Sampled for the stages in
+                                          sample_stages, else the larger of the start and the end of the stage. A new lifetime peak
+                                          reached in the stage is always used, since it also catches short peaks
+                   "children_rss_mb":     largest total resident memory of the running child processes (e.g. the simulator),
+                                          sampled for the stages in sample_stages only. None otherwise or without /proc
+                   "children_max_rss_mb": peak of the largest child process that finished in the stage, if it is larger than
+                                          every earlier child (getrusage only reports the largest). None otherwise
+    self.counters: dict of counters, e.g. nsteps, nfailed and duration reported by the simulator
+
+    sample_stages:   Names of the stages whose memory is sampled in a background thread while they run
+    sample_interval: Seconds between two samples
+    """
+
+    def __init__(self, sample_stages = ("simulation",), sample_interval: float = 0.05):
+        self.stages   = []
+        self.counters = {}
+        self.sample_stages   = tuple(sample_stages)
+        self.sample_interval = sample_interval
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Records the stage run inside the with block
+
+        Example:
+            with instrumentation.stage("simulation"):
+                rep.run(params)
+        """
+        sampler = _PeakSampler(self.sample_interval if name in self.sample_stages else None)
+        start = time.perf_counter()
+        try:
+            with sampler:
+                yield
+        finally:
+            self.stages.append({
+                "stage"               : name,
+                "seconds"             : time.perf_counter() - start,
+                "rss_mb"              : sampler.current_self,
+                "max_rss_mb"          : sampler.peak_self,
+                "children_rss_mb"     : sampler.peak_children,
+                "children_max_rss_mb" : sampler.finished_child,
+            })
+
+    def totals(self):
+        """
+        Total wall time of every stage name
+        """
+        totals = {}
+        for record in self.stages:
+            totals[record["stage"]] = totals.get(record["stage"], 0.0) + record["seconds"]
+        return totals
+
+    def to_dict(self):
+        return {"stages": self.stages, "totals": self.totals(), "counters": self.counters}
+
+
+def export_jsonl(sols, filename: str, **extra):
+    """
+    Appends the statistics of every solution (see SolutionClass.stats) as a line of JSON to the file, to aggregate over whole sweeps
+    sols:  A SolutionClass or a list of them
+    extra: Further entries written into every line, e.g. sweep="Shock-shape"
+    """
+    if not isinstance(sols, (list, tuple)):
+        sols = [sols]
+
+    with open(filename, "a") as file:
+        for sol in sols:
+            file.write(json.dumps(dict(sol.stats(), **extra), default=float) + "\n")
+
+
+def read_jsonl(filename: str):
+    """
+    Reads every line written by export_jsonl
+    """
+    with open(filename, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def summarize(records: list):
+    """
+    Sums the wall time of every stage over many records from read_jsonl and gives each stage's share of the total time
+    """
+    totals = {}
+    for record in records:
+        for stage, seconds in record["totals"].items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+
+    total = sum(totals.values())
+    return {stage: {"seconds": seconds, "fraction": seconds/total if total > 0 else 0.0}
+            for stage, seconds in sorted(totals.items(), key=lambda item: -item[1])}
+
+
+####################
+# Helper functions #
+####################
+def _rss_mb(pid = "self"):
+    """
+    Current resident memory of a process in MB. None where /proc is not available or the process is gone
+    """
+    try:
+        with open(f"/proc/{pid}/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _children_rss_mb():
+    """
+    Total current resident memory of every descendant process of this process in MB.
+    The children are read from /proc/<pid>/task/<tid>/children. None where that is not available
+    """
+    descendants, new = set(), [os.getpid()]
+    while new:
+        found = []
+        for pid in new:
+            for path in glob.glob(f"/proc/{pid}/task/*/children"):
+                try:
+                    with open(path, "r") as file:
+                        found += [int(child) for child in file.read().split()]
+                except (OSError, ValueError):
+                    continue
+        new = [pid for pid in found if pid not in descendants]
+        descendants.update(new)
+
+    if not descendants and not glob.glob(f"/proc/{os.getpid()}/task/*/children"):
+        return None
+    return sum(_rss_mb(pid) or 0.0 for pid in descendants)
+
+
+def _max_rss_mb(who):
+    """
+    Largest resident memory in MB over the whole lifetime of this process, or of its largest finished child process
+    """
+    return resource.getrusage(who).ru_maxrss * 1024 / 1e6 # ru_maxrss is in KiB on Linux
+
+
+class _PeakSampler:
+    """
+    Finds the largest resident memory of this process and of its child processes while the with block runs.
+    With an interval, the memory is sampled in a background thread. Without, only the start and the end are looked at.
+    When the lifetime peak reported by getrusage grows during the block, the new peak was reached in the block and is used too
+    """
+
+    def __init__(self, interval: float = None):
+        self.interval = interval
+        self.peak_self      = None
+        self.peak_children  = None
+        self.current_self   = None
+        self.finished_child = None
+        self._stop   = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True) if interval is not None else None
+
+    def __enter__(self):
+        self._start_max = {who: _max_rss_mb(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)} if resource is not None else {}
+        self._sample()
+        if self._thread is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self._sample()
+
+        if resource is not None:
+            end_self = _max_rss_mb(resource.RUSAGE_SELF)
+            if end_self > self._start_max[resource.RUSAGE_SELF]:
+                self.peak_self = max(self.peak_self or 0.0, end_self)
+            end_children = _max_rss_mb(resource.RUSAGE_CHILDREN)
+            if end_children > self._start_max[resource.RUSAGE_CHILDREN]:
+                self.finished_child = end_children
+        return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        self.current_self = _rss_mb()
+        if self.current_self is not None:
+            self.peak_self = max(self.peak_self or 0.0, self.current_self)
+        if self.interval is not None:
+            children = _children_rss_mb()
+            if children is not None:
+                self.peak_children = max(self.peak_children or 0.0, children)
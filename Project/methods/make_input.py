@@ -1,11 +1,28 @@
 from methods.make_tokamak_table import make_tokamak_table
-table = make_tokamak_table()
+
+_table = None
+
+def get_table():
+    """
+    The tokamak table, made the first time it is needed (see make_tokamak_table)
+    """
+    global _table
+    if _table is None:
+        _table = make_tokamak_table()
+    return _table
+
+def __getattr__(name):
+    # Keeps methods.make_input.table working without making the table on import
+    if name == "table":
+        return get_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def make_plasma_input():
     """
     Makes a dict of input parameters for the simulation
     """
-    
+
+    table = get_table()
     return {
     "grid" : {
         "Nx" : 32,
@@ -1,25 +1,75 @@
+import os
+import json
+import hashlib
 import numpy as np
-import feltorutilities as fp
+from methods.cache import CACHE_CONFIG, canonicalize
 
-def make_tokamak_table():
+# These parameters are for a Tokamak. "m_i" is the name of the ion mass in feltorutilities
+TOKAMAK_PHYSICAL = {"name" : "Compass",
+    "beta" : 1e-4, "resistivity": 1e-4, #change both to change n_0
+    "tau" : 1,
+    "m_i" : "deuteron_mass", "R_0" : 545, "R": 0.545,
+    "a": 0.175, "q":2, "scaleR" : 1.45, "Nz" : 32}
+
+# Quantities in the table besides the physical parameters
+TOKAMAK_SHOW = ["name", "mu", "R_0", "a_0", "beta", "resistivity",
+                "T_e", "n_0", "B_0", "CFL_diff", "epsilon_D",
+                "omega_0_inv", "viscosity_i", "viscosity_e", "rho_s","c_s"]
+
+
+def make_tokamak_table(physical: dict = None, use_cache: bool = None):
     """
     Makes table of relavent constants for the tokamak.
+    The table is stored as a small json file in the cache directory (see methods/cache.py), keyed by the physical parameters and
+    the version of feltorutilities, so feltorutilities is only imported and asked the first time.
+
+    physical:  Physical parameters of the tokamak. Defaults to TOKAMAK_PHYSICAL
+    use_cache: Whether to read and store the table in the cache. Defaults to CACHE_CONFIG["enabled"]
     """
 
-    # These parameters are for a Tokamak
-    show = ["name", "mu", "R_0", "a_0", "beta", "resistivity",
-            "T_e", "n_0", "B_0", "CFL_diff", "epsilon_D",
-            "omega_0_inv", "viscosity_i", "viscosity_e", "rho_s","c_s"]
-    physical={"name" : "Compass",
-        "beta" : 1e-4, "resistivity": 1e-4, #change both to change n_0
-        "tau" : 1,
-        "m_i" : fp.deuteron_mass, "R_0" : 545, "R": 0.545,
-        "a": 0.175, "q":2, "scaleR" : 1.45, "Nz" : 32}
+    if physical is None: physical = TOKAMAK_PHYSICAL
+    if use_cache is None: use_cache = CACHE_CONFIG["enabled"]
+
+    path = _table_path(physical)
+    if use_cache and os.path.isfile(path):
+        with open(path) as file:
+            return json.load(file)
+
+    import feltorutilities as fp
+
+    physical = dict(physical)
+    if isinstance(physical["m_i"], str):
+        physical["m_i"] = getattr(fp, physical["m_i"])
     fp.numerical2physical( physical, physical)
     table = dict()
-    for s in show + list(physical.keys()):
+    for s in TOKAMAK_SHOW + list(physical.keys()):
         table[s] = fp.parameters2quantity( physical, s)
 
     table["lx"] = 2*np.pi*table["R_0"]*3
 
-    return table
\ No newline at end of file
+    if use_cache:
+        # Writes to a temporary name first so other processes never read a half written table
+        os.makedirs(CACHE_CONFIG["directory"], exist_ok=True)
+        temp_path = "{}.{}.part".format(path, os.getpid())
+        with open(temp_path, "w") as file:
+            json.dump({key: (value.item() if isinstance(value, np.generic) else value) for key, value in table.items()}, file)
+        os.replace(temp_path, path)
+
+    return table
+
+
+####################
+# Helper functions #
+####################
+def _table_path(physical: dict):
+    """
+    Path of the cached table of the physical parameters
+    """
+    try:
+        from importlib.metadata import version
+        feltor_version = version("feltorutilities")
+    except Exception:
+        feltor_version = None
+
+    content = json.dumps({"physical": canonicalize(physical), "feltorutilities": feltor_version}, sort_keys=True, separators=(",", ":"))
+    return os.path.join(CACHE_CONFIG["directory"], "tokamak-{}.json".format(hashlib.sha256(content.encode()).hexdigest()[:16]))
@@ -1,4 +1,6 @@
+import copy
 import numpy as np
+from collections.abc import Mapping
 
 def dict_list_to_ndarr(input: dict):
     """
@@ -52,4 +54,101 @@ def sgn_change(arr, looping=False):
     sign_change_arr = ((sign_arr - np.roll(sign_arr, 1))/2).astype(int)
     if not looping: 
         sign_change_arr[0] = 0
-    return sign_change_arr
\ No newline at end of file
+    return sign_change_arr
+
+class ReadOnlyMapping(Mapping):
+    """
+    Read-only view of a dict, e.g. data_full, without copying it.
+    Nested dicts are wrapped the same way, lists become tuples and arrays are given as non-writeable views.
+    Entries are only wrapped when accessed, so the entries of a LazyData are still only loaded when used.
+    Changes made to the wrapped dict by its owner are seen through the view. Use copy.deepcopy for a mutable copy
+    """
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return read_only(self._data[key])
+
+    def __contains__(self, key):
+        # Keeps LazyData from loading the entry
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "ReadOnlyMapping({!r})".format(self._data)
+
+    def __deepcopy__(self, memo):
+        # A deep copy is the usual way of getting a mutable version
+        return copy.deepcopy(dict(self._data), memo)
+
+
+class ReadOnlyDict(dict):
+    """
+    dict that can not be changed, for small nested dicts like params and constants. Unlike ReadOnlyMapping it is a real dict,
+    so it can be written with json and passed wherever a dict is expected. Use copy.deepcopy for a mutable copy
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(f"'{type(self).__name__}' object can not be changed. Use copy.deepcopy for a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {copy.deepcopy(key, memo): copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class ReadOnlyList(list):
+    """
+    list that can not be changed, the list version of ReadOnlyDict
+    """
+
+    _read_only = ReadOnlyDict._read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def read_only_copy(value):
+    """
+    Copies the dicts and lists of a small nested value into ReadOnlyDict and ReadOnlyList. Arrays become non-writeable views, the array data is not copied
+    """
+    if isinstance(value, Mapping):
+        return ReadOnlyDict({key: read_only_copy(sub_value) for key, sub_value in value.items()})
+    if isinstance(value, list):
+        return ReadOnlyList(read_only_copy(sub_value) for sub_value in value)
+    return read_only(value)
+
+
+def read_only(value):
+    """
+    Gives a value that can not be changed in place, without copying any array data.
+    Arrays become non-writeable views, dicts become ReadOnlyMapping and lists become tuples. Other values are returned as they are
+    """
+    if isinstance(value, np.ndarray):
+        view = value.view()
+        view.flags.writeable = False
+        return view
+    if isinstance(value, Mapping) and not isinstance(value, (ReadOnlyMapping, ReadOnlyDict)):
+        return ReadOnlyMapping(value)
+    if isinstance(value, list) and not isinstance(value, ReadOnlyList):
+        return tuple(read_only(sub_value) for sub_value in value)
+    return value
@@ -0,0 +1,227 @@
+import os
+import copy
+import json
+import time
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+from methods.SolutionClass2 import SolutionClass, _reached_tend
+from methods.extract_data import time_view
+from methods.make_input import make_plasma_input
+from methods.wavefront import get_wavefront_positions
+from methods.cache import CACHE_CONFIG, params_key, cache_lookup, cache_store
+
+
+def run_monitored(params: dict, stop_when = None,
+                  two_fluid_file = "../temp_plasma",
+                  temp_json_file = "temp/temp.json",
+                  temp_nc_file   = "temp/temp.nc",
+                  poll_interval: float = 1.0,
+                  report = "print",
+                  use_cache = None,
+                  lazy = False,
+                 ):
+    """
+    Runs the simulation like SolutionClass, but watches the output file while the simulation runs.
+    Progress is reported after every poll, and the simulation is stopped as soon as one of the stopping conditions is met.
+    Returns a SolutionClass with the results up to that point. Its field stopped_by holds the name of the condition that stopped it, or None.
+
+    stop_when:     dict of {name: condition} or list of conditions. A condition is a function taking the data of the latest output time
+                   (same entries as SolutionClass.data) and returning True if the simulation should stop, see nan_check, front_beyond,
+                   steady_state and too_many_failed
+    poll_interval: Seconds between every look at the output file
+    report:        "print" to print the progress, None for nothing, or a function taking a dict with t, tend, nsteps, nfailed and outputs
+    use_cache:     Whether to return a cached simulation if possible and cache finished ones. Defaults to CACHE_CONFIG["enabled"]
+    lazy:          Whether to keep the output open and read the data when it is used, see SolutionClass
+
+    Example:
+        sol = run_monitored(params, {"nan": nan_check(), "front": front_beyond(4000, offset=0.5)}, poll_interval=10)
+    """
+
+    if stop_when is None:       stop_when = {}
+    if not isinstance(stop_when, dict):
+        stop_when = {getattr(condition, "__name__", str(i)): condition for i, condition in enumerate(stop_when)}
+    if report == "print":       report = print_progress
+    if use_cache is None:       use_cache = CACHE_CONFIG["enabled"]
+
+    sol = SolutionClass()
+    sol.params    = copy.deepcopy(params)
+    params        = sol.params # The copy is a plain dict, also for read-only params from SolutionClass.get_params
+    sol.constants = make_plasma_input()
+
+    # Reuses the output of an earlier identical simulation if possible
+    key = params_key(params, two_fluid_file) if use_cache else None
+    nc_file = cache_lookup(key) if use_cache else None
+    if nc_file is not None:
+        sol._open_output(sol._own_output(nc_file, temp_nc_file) if lazy else nc_file)
+        if not lazy: sol.close()
+        return sol
+
+    # Starts the simulation the same way as simplesimdb.Repeater
+    for file in (temp_json_file, temp_nc_file):
+        if os.path.isfile(file):
+            os.remove(file)
+    with open(temp_json_file, "w") as file:
+        json.dump(params, file, sort_keys=True, ensure_ascii=True, indent=4)
+
+    env = dict(os.environ, HDF5_USE_FILE_LOCKING="FALSE")
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen([two_fluid_file, temp_json_file, temp_nc_file], stdout=subprocess.DEVNULL, stderr=stderr, env=env)
+
+        try:
+            with sol.instrumentation.stage("simulation"), _file_locking_off():
+                _watch(process, temp_nc_file, params, stop_when, poll_interval, report, sol)
+        finally:
+            # Never leaves the simulation running, e.g. after a KeyboardInterrupt
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+        if process.returncode != 0 and sol.stopped_by is None:
+            stderr.seek(0)
+            print(stderr.read().decode(errors="replace"))
+
+    if sol.stopped_by is not None and report is not None:
+        print(f"Stopped by '{sol.stopped_by}'")
+
+    with sol.instrumentation.stage("open"):
+        nc_file = sol._own_output(temp_nc_file, temp_nc_file) if lazy else temp_nc_file
+        sol._open_output(nc_file)
+
+    # Only finished simulations are cached
+    if use_cache and sol.stopped_by is None and _reached_tend(sol._ncin.variables, params):
+        cache_store(key, nc_file)
+
+    if not lazy: sol.close()
+    return sol
+
+
+def print_progress(progress: dict):
+    """
+    Prints the progress of a monitored simulation
+    """
+    print("t = {:.5g} / {:.5g} ({:5.1f}%). Outputs {}. Function Calls {}. Failed {}".format(
+        progress["t"], progress["tend"], 100*progress["t"]/progress["tend"], progress["outputs"], progress["nsteps"], progress["nfailed"]))
+
+
+#######################
+# Stopping conditions #
+#######################
+def nan_check(keys = ("ne", "ni", "potential")):
+    """
+    Stops when any of the fields contain nan or inf
+    """
+    def nan_check(data):
+        return any(not np.all(np.isfinite(data[key])) for key in keys)
+    return nan_check
+
+
+def front_beyond(x_limit: float, key: str = "ni", offset: float = 0.5, direction: str = "right", change: str = "both"):
+    """
+    Stops when the wavefront (see get_wavefront_datapoint) has passed x_limit. For direction 'left' when it is to the left of x_limit
+    """
+    def front_beyond(data):
+        position = get_wavefront_positions(data[key], data["x"], offsets=offset, direction=direction, change=change)[0]
+        if np.isnan(position):
+            return False
+        return position > x_limit if direction == "right" else position < x_limit
+    return front_beyond
+
+
+def steady_state(key: str = "ni", rtol: float = 1e-6):
+    """
+    Stops when the field changes by less than rtol relative to its size per unit of time between two polls
+    """
+    previous = {}
+
+    def steady_state(data):
+        t, field = data["t"], np.array(data[key])
+        stop = False
+        if "t" in previous and t > previous["t"]:
+            change = np.linalg.norm(field - previous["field"], ord=1) / (t - previous["t"])
+            stop = change < rtol * np.linalg.norm(field, ord=1)
+        previous["t"], previous["field"] = t, field
+        return bool(stop)
+    return steady_state
+
+
+def too_many_failed(max_failed: int):
+    """
+    Stops when the number of failed time steps is larger than max_failed
+    """
+    def too_many_failed(data):
+        return data["nfailed"] > max_failed
+    return too_many_failed
+
+
+####################
+# Helper functions #
+####################
+def _watch(process, nc_file: str, params: dict, stop_when: dict, poll_interval: float, report, sol):
+    """
+    Polls the output file until the simulation ends or a stopping condition is met, which is then saved in sol.stopped_by
+    """
+    while process.poll() is None:
+        time.sleep(poll_interval)
+
+        progress, stopped_by = _check_output(nc_file, params, stop_when)
+        if progress is not None and report is not None:
+            report(progress)
+
+        if stopped_by is not None:
+            sol.stopped_by = stopped_by
+            process.terminate()
+            process.wait()
+            return
+
+
+def _check_output(nc_file: str, params: dict, stop_when: dict):
+    """
+    Reads the latest output time and evaluates the stopping conditions on it.
+    Returns (progress, name of the condition that fired or None). progress is None if the file can not be read yet
+    """
+    from netCDF4 import Dataset
+
+    try:
+        with Dataset(nc_file, 'r', format="NETCDF4") as ncin:
+            var = ncin.variables
+            last_idx = var["time"].shape[0]-1
+            if last_idx < 0:
+                return None, None
+
+            # Everything is read before the file is closed. Derived quantities are computed from it when a condition uses them
+            data = time_view(var, params, last_idx).load(derived=False)
+            progress = {
+                "t"       : data["t"],
+                "tend"    : params["output"]["tend"],
+                "outputs" : last_idx,
+                "nsteps"  : data["nsteps"],
+                "nfailed" : data["nfailed"],
+            }
+    except (OSError, RuntimeError, IndexError, KeyError):
+        # The simulation may be writing to the file right now
+        return None, None
+
+    # Errors of the conditions are not caught, so mistakes in them are not hidden
+    for name, condition in stop_when.items():
+        if condition(data):
+            return progress, name
+
+    return progress, None
+
+
+@contextlib.contextmanager
+def _file_locking_off():
+    """
+    Turns off HDF5 file locking in this process inside the with block only, so the output can be read while the simulation writes to it
+    """
+    previous = os.environ.get("HDF5_USE_FILE_LOCKING")
+    os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("HDF5_USE_FILE_LOCKING", None)
+        else:
+            os.environ["HDF5_USE_FILE_LOCKING"] = previous
@@ -0,0 +1,140 @@
+import numpy as np
+from methods.SolutionClass2 import ANIMATION_LAYOUT
+
+# Title and y label of every field, as in animate_all
+FIELD_TITLES = {key: (title, ylabel) for row in ANIMATION_LAYOUT for key, title, ylabel in row}
+
+
+def downsample(x, y, buckets: int):
+    """
+    Shape preserving downsampling of curves: the points are split into buckets along x, and the first, smallest,
+    largest and last point of every bucket are kept (M4). With one bucket per pixel column the drawn curve looks the same
+    as with every point, including extrema and shocks.
+    Returns (x, y) with at most 4*buckets points per curve. Does nothing for curves with fewer points
+
+    x: Positions, shape (x,)
+    y: Curves of shape (..., x)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = y.shape[-1]
+    if buckets < 1 or n <= 4*buckets:
+        return np.broadcast_to(x, y.shape), y
+
+    size = -(-n // buckets)
+    pad  = size*buckets - n
+    padded = np.concatenate([y, np.repeat(y[..., -1:], pad, axis=-1)], axis=-1) if pad else y
+    padded = padded.reshape(y.shape[:-1] + (buckets, size))
+
+    # nan would be picked by argmin/argmax and hide the rest of the bucket
+    filled = np.where(np.isnan(padded), np.nanmean(padded, axis=-1, keepdims=True) if np.isnan(padded).any() else 0, padded)
+    offset = np.arange(buckets)[:, None]*size
+    indices = np.concatenate([
+        np.broadcast_to(offset, y.shape[:-1] + (buckets, 1)),
+        np.argmin(filled, axis=-1)[..., None] + offset,
+        np.argmax(filled, axis=-1)[..., None] + offset,
+        np.broadcast_to(offset + size-1, y.shape[:-1] + (buckets, 1)),
+    ], axis=-1)
+    indices = np.minimum(np.sort(indices, axis=-1), n-1).reshape(y.shape[:-1] + (4*buckets,))
+
+    return x[indices], np.take_along_axis(y, indices, axis=-1)
+
+
+class OverlayPlot:
+    """
+    Plots a field of many solutions on top of each other, one axis per field. The figure and the lines are made once
+    and only get new data on every update, and every curve is downsampled to the pixel width of its axis,
+    so redrawing hundreds of runs (e.g. with a time slider in %matplotlib widget) stays fast.
+
+    fields:  Keys of data_full to plot, one axis each
+    ncols:   Number of columns of axes. Defaults to up to 3
+    figsize: Size of the figure. Defaults to 8x5 inches per axis
+    legend:  Whether to show a legend. Only shown for up to 10 solutions
+
+    Example:
+        overlay = OverlayPlot(["ni", "ne", "potential"])
+        overlay.update(sols, time_index=40)
+        ipywidgets.interact(lambda ti: overlay.update(sols, ti), ti=(0, 100))
+    """
+
+    def __init__(self, fields = ("ne", "ni", "potential"), ncols: int = None, figsize = None, legend: bool = True):
+        import matplotlib.pyplot as plt
+
+        self.fields = list(fields)
+        ncols = min(3, len(self.fields)) if ncols is None else ncols
+        nrows = -(-len(self.fields) // ncols)
+        if figsize is None:
+            figsize = (8*ncols, 5*nrows)
+
+        self.fig, axes = plt.subplots(nrows, ncols, figsize=figsize, squeeze=False)
+        self.axes = dict(zip(self.fields, axes.ravel()))
+        for ax in axes.ravel()[len(self.fields):]:
+            ax.set_visible(False)
+
+        for key, ax in self.axes.items():
+            title, ylabel = FIELD_TITLES.get(key, (key, key))
+            ax.set_title(title)
+            ax.set_xlabel("$x$")
+            ax.set_ylabel(ylabel)
+            ax.grid(True)
+
+        self.legend = legend
+        self.lines  = {key: [] for key in self.fields}
+
+    def update(self, sols: list, time_index: int = -1, labels: list = None, xlim = None):
+        """
+        Plots the solutions at a time index, reusing the lines of the previous update
+        sols:   List of SolutionClass objects (or anything with data_full)
+        labels: Legend entry of every solution. Defaults to data_full["label"]
+        xlim:   Optional x range. Only the points inside it are used
+        """
+        if labels is None:
+            labels = [sol.data_full["label"] if "label" in sol.data_full else str(i) for i, sol in enumerate(sols)]
+
+        # Solutions on the same grid are downsampled together
+        xs = [np.asarray(sol.data_full["x"]) for sol in sols]
+        if xlim is not None:
+            inside = [(x >= xlim[0]) & (x <= xlim[1]) for x in xs]
+            xs = [x[mask] for x, mask in zip(xs, inside)]
+        shared = len(xs) > 0 and all(x.shape == xs[0].shape and (x is xs[0] or np.array_equal(x, xs[0])) for x in xs)
+
+        for key, ax in self.axes.items():
+            buckets = max(1, int(ax.get_window_extent().width))
+            lines = self.lines[key]
+
+            # Only as many lines as solutions, the rest are hidden for later updates
+            while len(lines) < len(sols):
+                lines.append(ax.plot([], [])[0])
+            for line in lines[len(sols):]:
+                line.set_visible(False)
+                line.set_label("_nolegend_")
+                line.set_data([], [])
+
+            ys = [np.asarray(sol.data_full[key][time_index]) for sol in sols]
+            if xlim is not None:
+                ys = [y[mask] for y, mask in zip(ys, inside)]
+            if shared:
+                x_down, y_down = downsample(xs[0], np.stack(ys), buckets)
+            else:
+                x_down, y_down = zip(*(downsample(x, y, buckets) for x, y in zip(xs, ys)))
+
+            for line, x, y, label in zip(lines, x_down, y_down, labels):
+                line.set_data(x, y)
+                line.set_label(label)
+                line.set_visible(True)
+
+            ax.relim(visible_only=True)
+            ax.autoscale_view()
+            if xlim is not None:
+                ax.set_xlim(xlim)
+
+        first = self.axes[self.fields[0]]
+        t = np.asarray(sols[0].data_full["t"])[time_index] if len(sols) > 0 else np.nan
+        first.set_title("{} t = {:5.5f}".format(FIELD_TITLES.get(self.fields[0], (self.fields[0],))[0], t))
+        if self.legend and 0 < len(sols) <= 10:
+            first.legend(loc="upper right") # 'best' searches every point of every line
+        elif first.get_legend() is not None:
+            first.get_legend().remove()
+
+        self.fig.canvas.draw_idle()
+        return self
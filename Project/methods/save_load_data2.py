@@ -1,18 +1,67 @@
+import os
+import copy
+import glob
+import hashlib
+import threading
+import concurrent.futures
 import numpy as np
-import pandas as pd
 import json
 from methods.SolutionClass2 import SolutionClass
+from methods.extract_data import LazyData, DERIVED, add_derived
 from methods.misc import *
 
+# Arrays that are usually identical across runs. They are stored once in a '_grids' directory next to the saved runs
+SHARED_ARRAYS = ("x",)
 
-def save_data(sol: SolutionClass, filename: str="_savedata"):
+# Entries of data_full that are always loaded, even if only some fields are asked for
+META_KEYS = ("label", "last_idx", "nsteps", "nfailed", "duration", "t", "x")
+
+# Raw entries of data_full kept by full_to_final_solution. Metadata and the grid are taken whole, the rest at the final time.
+# Derived quantities (see DERIVED in extract_data) are kept too
+FINAL_KEYS = ["label", "last_idx", "nsteps", "nfailed", "duration", "t", "x",
+              "ne", "ue", "Te", "ni", "ui", "Ti", "potential"]
+
+# Storage profiles for save_data. Every setting left out of a profile is taken from "full"
+#   dtype:       Floating point type of the stored arrays, e.g. "float32" or "float16". None keeps the type
+#   compress:    Whether arrays are stored compressed (.npz). These are decompressed when first used instead of memory-mapped
+#   time_stride: Only every time_stride'th output time is stored. The final time is always kept
+#   x_stride:    Only every x_stride'th grid point is stored. The last point is always kept
+#   fields:      Keys of data_full to store, or None for every key. Metadata, t and x are always stored.
+#                Derived quantities left out are computed again from the stored fields when loaded
+STORAGE_PROFILES = {
+    "full"    : {"dtype": None, "compress": False, "time_stride": 1, "x_stride": 1, "fields": None},
+    "float32" : {"dtype": "float32"},
+    "archive" : {"dtype": "float32", "compress": True},
+    "plot"    : {"dtype": "float32", "compress": True, "fields": ["ne", "ue", "Te", "ni", "ui", "Ti", "potential"]},
+    "fronts"  : {"dtype": "float32", "compress": True, "fields": ["ne", "ni", "Te"]},
+}
+
+
+def save_data(sol: SolutionClass, filename: str="_savedata", format: str="npy", profile="full"):
     """
-    Saves the data from a SolutionClass to the specified file as JSON
+    Saves the data from a SolutionClass to the specified file
+    format: 'npy':  Binary format. Makes the directory filename.run with every array as a .npy file and params,
+                    constants and other metadata in meta.json. Shared grid arrays are only stored once per directory.
+            'json': Everything in a single JSON file filename.json (old format, slow for large runs)
+    profile: Name of a profile in STORAGE_PROFILES or a dict of settings, reducing the size of the saved run.
+             The settings and the precision lost are stored with the run and given as sol.storage when loaded.
+             The json format only supports time_stride, x_stride and fields
     """
-    
+
+    profile = _make_profile(profile)
+    if format == "npy":
+        _save_npy(sol, filename, profile)
+        return
+    if format != "json":
+        raise ValueError(f"format should be either 'npy' or 'json'. Was '{format}'")
+    if profile["dtype"] is not None or profile["compress"]:
+        raise ValueError("dtype and compress are only supported by the 'npy' format")
+
+    data_full, storage = _apply_profile(sol.data_full, profile)
+
     # Saves to file
     with open(filename + r".json", "w") as file:
-        meta = {"data_full": sol.data_full, "params": sol.params, "constants": sol.constants}
+        meta = {"data_full": data_full, "params": copy.deepcopy(sol.params), "constants": copy.deepcopy(sol.constants), "storage": storage}
 
         # Changes the array type throughout the dictionary to lists instead of ndarrays
         dict_ndarr_to_list(meta)
@@ -20,21 +69,30 @@ def save_data(sol: SolutionClass, filename: str="_savedata"):
         json.dump(meta, file)
 
 
-def load_data(filename: str="_savedata"):
+def load_data(filename: str="_savedata", fields: list=None):
     """
-    Loads data into a SolutionClass from a file
+    Loads data into a SolutionClass from a file saved with save_data in any format.
+    Arrays of the binary format are memory-mapped, so only the parts that are actually used are read from disk.
+    fields: Optional list of keys of data_full to keep. Metadata, t and x are always kept
     """
 
+    if os.path.isdir(filename + r".run"):
+        return _load_npy(filename, fields)
+
     sol = SolutionClass()
 
     with open(filename + r".json", "r") as file:
         load = json.load(file)
 
-        sol.data_full = load["data_full"]
-        dict_list_to_ndarr(sol.data_full) # Transforms into ndarrays for more convenience
-        sol.data      = full_to_final_solution(sol.data_full)
+        data_full = load["data_full"]
+        if fields is not None:
+            data_full = {key: value for key, value in data_full.items() if key in fields or key in META_KEYS}
+        dict_list_to_ndarr(data_full) # Transforms into ndarrays for more convenience
         sol.params    = load["params"]
         sol.constants = load["constants"]
+        sol.storage   = load.get("storage")
+        sol.data_full = add_derived(LazyData({key: (lambda value=value: value) for key, value in data_full.items()}), sol.params)
+        sol.data      = full_to_final_solution(sol.data_full, sol.params)
 
         # Changes the array type throughout the dictionary to ndarrays instead of lists
 
@@ -43,54 +101,258 @@ def load_data(filename: str="_savedata"):
     return sol
 
 
-def full_to_final_solution(full_sol):
+def load_params(filename: str):
+    """
+    Loads only the params of a run saved with save_data. For the binary format only meta.json is read, none of the arrays
+    """
+
+    if os.path.isdir(filename + r".run"):
+        with open(os.path.join(filename + r".run", "meta.json"), "r") as file:
+            return json.load(file)["params"]
+    if os.path.isfile(filename + r".json"):
+        with open(filename + r".json", "r") as file:
+            return json.load(file)["params"]
+    raise FileNotFoundError(f"No saved run '{filename}': neither {filename}.run nor {filename}.json exist")
+
+
+def load_many(paths, fields: list=None, workers: int=None, executor: str="auto"):
+    """
+    Loads many saved runs in parallel.
+    Returns a dict of {filename: SolutionClass}, sorted by filename so the order is always the same.
+    paths:    Directory, glob pattern (e.g. "DATA/Shock-shape/n=*") or list of filenames without extension
+    fields:   Optional list of keys of data_full to keep, see load_data
+    workers:  Number of threads or processes. Defaults to the number of cores
+    executor: 'thread':  Threads. Best for the binary format, where loading only memory-maps the files
+              'process': Processes. Best for the JSON format, where parsing holds the interpreter lock
+              'auto':    Processes if any of the runs are JSON files, else threads
+    """
+
+    filenames = find_saved(paths)
+
+    if executor == "auto":
+        executor = "thread" if all(os.path.isdir(filename + r".run") for filename in filenames) else "process"
+    if   executor == "thread":  pool = concurrent.futures.ThreadPoolExecutor(workers)
+    elif executor == "process": pool = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        raise ValueError(f"executor should be either 'auto', 'thread' or 'process'. Was '{executor}'")
+
+    with pool:
+        sols = list(pool.map(load_data, filenames, [fields]*len(filenames)))
+
+    return dict(zip(filenames, sols))
+
+
+def find_saved(paths):
     """
-    Transforms a dataset for every time into a dataset for only the final time.
+    Gives the sorted filenames (without extension) of the saved runs in a directory, matching a glob pattern, or in a list
     """
 
-    # For old system without temperature fields
-    try:
-        Te = full_sol["te"]
-        Ti = full_sol["ti"]
-    except:
-        print("Error: No temperature fields found. Setting to zero")
-        Te = Ti = np.zeros(full_sol["x"].shape)
+    if isinstance(paths, str):
+        if os.path.isdir(paths) and not paths.endswith(r".run"):
+            paths = os.path.join(paths, "*")
+        paths = glob.glob(paths)
+
+    filenames = set()
+    for path in paths:
+        for extension in (r".json", r".run"):
+            if path.endswith(extension):
+                path = path[:-len(extension)]
+        if os.path.isfile(path + r".json") or os.path.isdir(path + r".run"):
+            filenames.add(path)
+
+    return sorted(filenames)
+
+
+def full_to_final_solution(full_sol, params: dict = None):
+    """
+    Transforms a dataset for every time into a lazy dataset for only the final time.
+    Every entry is only sliced from full_sol when it is first used. Entries missing in full_sol are left out.
+    params: If given, derived quantities missing in full_sol are computed from the final time instead, see add_derived
+    """
 
     last_idx = full_sol["last_idx"]
-    return {
-        # metadata
-        "label"    : full_sol["label"],
-        "last_idx" : last_idx,
-        "nsteps"   : full_sol["nsteps"][last_idx],
-        "nfailed"  : full_sol["nfailed"][last_idx],
-        "duration" : full_sol["duration"][last_idx],
-
-        # Time and space
-        "t"       : full_sol["t"][last_idx],
-        "x"       : full_sol["x"],
-
-        # Electrons
-        "ne"      : full_sol["ne"][last_idx],
-        "ue"      : full_sol["ue"][last_idx],
-        "Te"      : full_sol["Te"][last_idx],
-        "norm_ne" : full_sol["norm_ne"][last_idx],
-        "norm_ue" : full_sol["norm_ue"][last_idx],
-        "norm_Te" : full_sol["norm_Te"][last_idx],
-
-        # Ions
-        "ni"      : full_sol["ni"][last_idx],
-        "ui"      : full_sol["ui"][last_idx],
-        "Ti"      : full_sol["Ti"][last_idx],
-        "norm_ni" : full_sol["norm_ni"][last_idx],
-        "norm_ui" : full_sol["norm_ui"][last_idx],
-        "norm_Ti" : full_sol["norm_Ti"][last_idx],
-
-        # System
-        "charge"    : full_sol["charge"][last_idx],
-        "potential" : full_sol["potential"][last_idx],
-        "electric"  : full_sol["electric"][last_idx],
-
-        #"m"      : total_mass,
-        #"p"      : total_momentum,
-        #"E"      : total_energy,
-    }
\ No newline at end of file
+
+    def final(key):
+        if key in ("label", "last_idx", "x"):
+            return full_sol[key]
+        return full_sol[key][last_idx]
+
+    def sliced(key):
+        # Derived quantities full_sol would have to compute for every time are computed for the final time only
+        if key not in full_sol:
+            return False
+        if params is None or key not in DERIVED or not isinstance(full_sol, LazyData):
+            return True
+        return full_sol.is_loaded(key) or key not in full_sol._depends
+
+    keys = FINAL_KEYS + [key for key in DERIVED if key not in FINAL_KEYS]
+    final_sol = LazyData({key: (lambda key=key: final(key)) for key in keys if sliced(key)})
+    if params is not None:
+        add_derived(final_sol, params)
+
+    return final_sol
+
+
+####################
+# Helper functions #
+####################
+def _save_npy(sol: SolutionClass, filename: str, profile: dict):
+    """
+    Saves the data from a SolutionClass in the binary format. See save_data
+    """
+
+    run_dir  = filename + r".run"
+    grid_dir = os.path.join(os.path.dirname(run_dir), "_grids")
+    os.makedirs(run_dir, exist_ok=True)
+
+    data_full, storage = _apply_profile(sol.data_full, profile)
+
+    meta = {"params": copy.deepcopy(sol.params), "constants": copy.deepcopy(sol.constants), "keys": list(data_full.keys()), "data_full": {}, "arrays": {}, "storage": storage}
+    dict_ndarr_to_list(meta)
+
+    # Leftovers of an earlier save with another profile would be loaded instead of the new arrays
+    for file in glob.glob(os.path.join(run_dir, "*.np[yz]")):
+        os.remove(file)
+
+    for key, value in data_full.items():
+        if not isinstance(value, np.ndarray):
+            meta["data_full"][key] = value.item() if isinstance(value, np.generic) else value
+            continue
+
+        value = np.ascontiguousarray(value)
+        if key in SHARED_ARRAYS:
+            # Named by content, so runs on the same grid point to the same file
+            os.makedirs(grid_dir, exist_ok=True)
+            digest = hashlib.sha1(str((value.dtype.str, value.shape)).encode() + value.tobytes()).hexdigest()
+            path = os.path.join(grid_dir, f"{key}-{digest}.npy")
+            if not os.path.isfile(path):
+                # Saves under a temporary name first so runs saved in parallel never map a half written grid
+                temp_path = "{}.{}.{}.part".format(path, os.getpid(), threading.get_ident())
+                with open(temp_path, "wb") as file:
+                    np.save(file, value)
+                os.replace(temp_path, path)
+        elif profile["compress"]:
+            path = os.path.join(run_dir, f"{key}.npz")
+            np.savez_compressed(path, value)
+        else:
+            path = os.path.join(run_dir, f"{key}.npy")
+            np.save(path, value)
+
+        meta["arrays"][key] = os.path.relpath(path, run_dir)
+
+    with open(os.path.join(run_dir, "meta.json"), "w") as file:
+        json.dump(meta, file)
+
+
+def _load_npy(filename: str, fields: list=None):
+    """
+    Loads a SolutionClass saved in the binary format, with every uncompressed array memory-mapped
+    """
+
+    run_dir = filename + r".run"
+    with open(os.path.join(run_dir, "meta.json"), "r") as file:
+        meta = json.load(file)
+
+    sol = SolutionClass()
+    sol.data_full = LazyData()
+    for key in meta["keys"]:
+        if fields is not None and key not in fields and key not in META_KEYS:
+            continue
+        if key in meta["arrays"]:
+            sol.data_full._loaders[key] = lambda path=os.path.join(run_dir, meta["arrays"][key]): _load_array(path)
+        else:
+            sol.data_full[key] = meta["data_full"][key]
+
+    sol.params    = meta["params"]
+    sol.constants = meta["constants"]
+    sol.storage   = meta.get("storage")
+    add_derived(sol.data_full, sol.params)
+    sol.data      = full_to_final_solution(sol.data_full, sol.params)
+
+    return sol
+
+
+def _load_array(path: str):
+    """
+    Memory-maps a .npy file, or decompresses the array of a .npz file
+    """
+    if path.endswith(".npz"):
+        with np.load(path) as arrays:
+            return arrays["arr_0"]
+    return np.load(path, mmap_mode="r")
+
+
+def _make_profile(profile):
+    """
+    Gives every setting of a storage profile, from its name in STORAGE_PROFILES or a dict of settings
+    """
+    if isinstance(profile, str):
+        if profile not in STORAGE_PROFILES:
+            raise ValueError(f"Unknown storage profile '{profile}'. Profiles are {list(STORAGE_PROFILES)}")
+        profile = STORAGE_PROFILES[profile]
+
+    unknown = set(profile) - set(STORAGE_PROFILES["full"])
+    if unknown:
+        raise ValueError(f"Unknown storage settings {sorted(unknown)}. Settings are {list(STORAGE_PROFILES['full'])}")
+
+    profile = dict(STORAGE_PROFILES["full"], **profile)
+    if profile["time_stride"] < 1 or profile["x_stride"] < 1:
+        raise ValueError("time_stride and x_stride should be at least 1")
+    return profile
+
+
+def _strided(n: int, stride: int):
+    """
+    Every stride'th index of n, always including the last one
+    """
+    indices = np.arange(0, n, stride)
+    if n > 0 and indices[-1] != n-1:
+        indices = np.append(indices, n-1)
+    return indices
+
+
+def _apply_profile(data_full, profile: dict):
+    """
+    Reduces data_full as described by a storage profile.
+    Returns (reduced data_full as a dict, storage metadata with the profile and the precision lost for every key)
+    """
+
+    n_t = len(data_full["t"])
+    n_x = len(data_full["x"])
+    t_idx = _strided(n_t, profile["time_stride"])
+    x_idx = _strided(n_x, profile["x_stride"])
+
+    storage = {"profile": profile, "time_indices": t_idx.tolist() if profile["time_stride"] > 1 else None,
+               "n_t": n_t, "n_x": n_x, "max_abs_error": {}, "max_rel_error": {}}
+
+    reduced = {}
+    for key in data_full:
+        if profile["fields"] is not None and key not in profile["fields"] and key not in META_KEYS:
+            continue
+
+        value = data_full[key]
+        if key == "last_idx":
+            reduced[key] = len(t_idx)-1
+            continue
+        if not isinstance(value, np.ndarray) or value.ndim == 0:
+            reduced[key] = value
+            continue
+
+        # Time series have time as the first axis, fields have x as the last axis
+        if key != "x" and value.shape[0] == n_t:
+            value = value[t_idx]
+        if key == "x" or (value.ndim == 2 and value.shape[-1] == n_x):
+            value = value[..., x_idx]
+
+        # Time, grid and counters keep their type, so the output times and positions stay exact
+        if profile["dtype"] is not None and key not in META_KEYS and np.issubdtype(value.dtype, np.floating):
+            stored = value.astype(profile["dtype"])
+            error = np.abs(stored.astype(value.dtype) - value)
+            scale = np.max(np.abs(value)) if value.size > 0 else 0.0
+            storage["max_abs_error"][key] = float(np.max(error)) if value.size > 0 else 0.0
+            storage["max_rel_error"][key] = storage["max_abs_error"][key]/float(scale) if scale > 0 else 0.0
+            value = stored
+
+        reduced[key] = value
+
+    return reduced, storage
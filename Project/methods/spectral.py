@@ -0,0 +1,239 @@
+import hashlib
+import weakref
+import numpy as np
+from methods.sweep_dataset import SweepDataset
+
+# Spectra already computed for a run, {sol: {settings: result}}. Entries disappear with the run
+_SPECTRUM_CACHE = weakref.WeakKeyDictionary()
+
+
+def resample_uniform(t, data, axis: int = -2):
+    """
+    Linearly interpolates data onto equally spaced times between t[0] and t[-1], with as many times as t.
+    Returns (uniform t, resampled data). Data on equally spaced times is returned as it is
+    axis: The time axis of data
+    """
+    t = np.asarray(t, dtype=float)
+    data = np.asarray(data)
+    if len(t) < 3 or np.allclose(np.diff(t), t[1]-t[0], rtol=1e-6, atol=0):
+        return t, data
+
+    t_uniform = np.linspace(t[0], t[-1], len(t))
+    upper = np.clip(np.searchsorted(t, t_uniform, side="right"), 1, len(t)-1)
+    weight = (t_uniform - t[upper-1]) / (t[upper] - t[upper-1])
+
+    data = np.moveaxis(data, axis, -1)
+    resampled = data[..., upper-1]*(1-weight) + data[..., upper]*weight
+    return t_uniform, np.moveaxis(resampled, -1, axis)
+
+
+def spectrum(data, t, window = "hanning", detrend: bool = True, axis: int = -2):
+    """
+    Windowed FFT along the time axis of data, for every other axis at once, e.g. all positions x of all runs.
+    Returns (angular frequencies omega, abs(fft) with the time axis replaced by the frequency axis)
+
+    data:    Array with one time axis, e.g. data_full["electric"] of shape (time, x) or a stack of runs of shape (runs..., time, x)
+    t:       Output times. Times that are not equally spaced are resampled first, see resample_uniform
+    window:  Name of a numpy window function ('hanning', 'hamming', 'blackman', 'bartlett') or None.
+             Spectra with a window are scaled by len(t)/sum(window), so peak heights compare to the ones without
+    detrend: Whether to remove the time average first, which removes the peak at omega = 0
+    """
+    t, data = resample_uniform(t, data, axis=axis)
+    data = np.moveaxis(np.asarray(data, dtype=float), axis, -1)
+
+    if detrend:
+        data = data - data.mean(axis=-1, keepdims=True)
+    if window is not None:
+        weights = _window(window, data.shape[-1])
+        data = data * weights * (len(weights)/weights.sum())
+
+    fft = np.abs(np.fft.rfft(data, axis=-1))
+    omega = 2*np.pi * np.fft.rfftfreq(data.shape[-1], d=t[1]-t[0])
+    return omega, np.moveaxis(fft, -1, axis)
+
+
+def short_time_spectrum(data, t, segment: int, overlap: int = None, window = "hanning", detrend: bool = True, axis: int = -2):
+    """
+    Spectra of overlapping segments of the time series, to follow how the frequencies change in time.
+    Returns (time at the middle of every segment, angular frequencies omega, abs(fft)),
+    where the time axis of data is replaced by a segment axis followed by a frequency axis
+
+    segment: Number of output times in every segment
+    overlap: Number of output times shared by two segments next to each other. Defaults to half a segment
+    """
+    if overlap is None:
+        overlap = segment//2
+    if not 0 <= overlap < segment:
+        raise ValueError(f"overlap should be between 0 and segment-1 = {segment-1}. Was {overlap}")
+
+    t, data = resample_uniform(t, data, axis=axis)
+    data = np.moveaxis(np.asarray(data, dtype=float), axis, -1)
+    if data.shape[-1] < segment:
+        raise ValueError(f"segment = {segment} is longer than the {data.shape[-1]} output times")
+
+    # Segments are views into data, shape (..., segments, segment)
+    step = segment - overlap
+    segments = np.lib.stride_tricks.sliding_window_view(data, segment, axis=-1)[..., ::step, :]
+    t_mid = np.lib.stride_tricks.sliding_window_view(t, segment)[::step].mean(axis=-1)
+
+    omega, fft = spectrum(segments, t[:segment], window=window, detrend=detrend, axis=-1)
+
+    # (..., segments, frequencies) -> time axis replaced by (segments, frequencies)
+    axis = axis % (data.ndim)
+    fft = np.moveaxis(fft, (-2, -1), (axis, axis+1))
+    return t_mid, omega, fft
+
+
+def peak_frequencies(omega, amplitude, omega_min: float = None, omega_max: float = None, axis: int = -2):
+    """
+    Finds the frequency of the largest peak of every spectrum between omega_min and omega_max.
+    The position is refined by a parabola through the largest value and its two neighbours.
+    Returns (peak omega, peak amplitude), with the frequency axis removed
+
+    omega, amplitude: As given by spectrum
+    """
+    omega = np.asarray(omega)
+    amplitude = np.moveaxis(np.asarray(amplitude), axis, -1)
+
+    band = np.ones(len(omega), dtype=bool)
+    if omega_min is not None: band &= omega >= omega_min
+    if omega_max is not None: band &= omega <= omega_max
+    if not band.any():
+        raise ValueError(f"No frequencies between omega_min = {omega_min} and omega_max = {omega_max}")
+
+    masked = np.where(band, amplitude, -np.inf)
+    i = np.argmax(masked, axis=-1)
+    peak = np.take_along_axis(amplitude, i[..., None], axis=-1)[..., 0]
+
+    # Parabolic refinement, only where both neighbours exist
+    left  = np.take_along_axis(amplitude, np.clip(i-1, 0, len(omega)-1)[..., None], axis=-1)[..., 0]
+    right = np.take_along_axis(amplitude, np.clip(i+1, 0, len(omega)-1)[..., None], axis=-1)[..., 0]
+    curvature = left - 2*peak + right
+    inner = (i > 0) & (i < len(omega)-1) & (curvature < 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shift = np.where(inner, 0.5*(left - right)/curvature, 0.0)
+
+    d_omega = omega[1] - omega[0] if len(omega) > 1 else 0.0
+    return omega[i] + shift*d_omega, peak - 0.25*(left - right)*shift
+
+
+def theoretical_omega(k, T_e0, n_e0, nu_ue, mu_e, epsilon_D):
+    """
+    Electron plasma wave frequencies from the dispersion relation, for arrays of k, T_e0 and n_e0 (broadcast together with the constants).
+    Returns dict with
+        "omega":                complex frequency with the damping by the electron viscosity nu_ue
+        "omega_approx":         sqrt((3 k^2 T_e0 + n_e0/epsilon_D)/mu_e), without the damping
+        "omega_approx_reduced": sqrt(n_e0/epsilon_D/mu_e), the cold plasma frequency
+    """
+    k, T_e0, n_e0, nu_ue, mu_e, epsilon_D = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (k, T_e0, n_e0, nu_ue, mu_e, epsilon_D)))
+
+    root = np.sqrt((-k**4*nu_ue**2 + 4*n_e0**2*(3*k**2*T_e0 + n_e0/epsilon_D)/mu_e).astype(complex))
+    return {
+        "omega"                : (-1j*k**2*nu_ue + root) / 2*n_e0,
+        "omega_approx"         : np.sqrt((3*k**2*T_e0 + n_e0/epsilon_D)/mu_e),
+        "omega_approx_reduced" : np.sqrt(n_e0/epsilon_D/mu_e),
+    }
+
+
+def frequency_study(runs, key: str = "electric", omega_min: float = None, omega_max: float = None,
+                    window = "hanning", detrend: bool = True,
+                    k: str = "k", T_e0: str = "t_0", n_e0: str = "n_0",
+                   ):
+    """
+    Spectra, peak frequencies and theoretical frequencies of many runs in one call.
+    Runs not seen before with the same settings are stacked and transformed together. The result of every run is cached
+
+    runs: List of SolutionClass objects or a SweepDataset. For a SweepDataset every result has the shape of its parameter axes
+          first, with nan where no run exists
+    key:  Field to transform
+    k, T_e0, n_e0: Names in params["init"] of the wavenumber, temperature and density used for theoretical_omega
+
+    Returns dict with
+        "frequencies": the angular frequencies of the spectra
+        "amplitude":   abs(fft) of shape (runs..., frequencies, x)
+        "peak":        the peak frequency of shape (runs..., x)
+        "peak_amplitude", "k", "T_e0", "n_e0", and the entries of theoretical_omega of shape (runs...)
+
+    Example (the nine run frequency study of Wiggleplots):
+        sweep = SweepDataset.from_glob("DATA/Plasma-freq_data 2 LARGE/*", ["k", "t_0"])
+        study = frequency_study(sweep, omega_min=8800, omega_max=10700)
+        study["peak"][..., len(sweep.x)//2] - study["omega_approx"]
+    """
+    if isinstance(runs, SweepDataset):
+        run_index = runs.run_index
+        sols = [runs.run(i) for i in range(int(np.sum(run_index >= 0)))]
+    else:
+        sols = list(runs)
+        run_index = np.arange(len(sols))
+
+    settings = (key, omega_min, omega_max, window, detrend, k, T_e0, n_e0)
+    missing = [sol for sol in sols if settings not in _SPECTRUM_CACHE.get(sol, {})]
+
+    # Runs on the same times and grid are transformed as one batch. The whole time array is part of the key, since output times may be non-uniform
+    groups = {}
+    for sol in missing:
+        t = np.ascontiguousarray(sol.data_full["t"], dtype=float)
+        groups.setdefault((hashlib.sha1(t.tobytes()).hexdigest(), np.shape(sol.data_full[key])), []).append(sol)
+
+    for group in groups.values():
+        omega, amplitude = spectrum(np.stack([np.asarray(sol.data_full[key]) for sol in group]), group[0].data_full["t"],
+                                    window=window, detrend=detrend)
+        peak, peak_amplitude = peak_frequencies(omega, amplitude, omega_min, omega_max)
+        theory = theoretical_omega([sol.params["init"][k]    for sol in group],
+                                   [sol.params["init"][T_e0] for sol in group],
+                                   [sol.params["init"][n_e0] for sol in group],
+                                   *np.array([_dispersion_constants(sol) for sol in group]).T)
+
+        for j, sol in enumerate(group):
+            result = {"frequencies": omega, "amplitude": amplitude[j], "peak": peak[j], "peak_amplitude": peak_amplitude[j],
+                      "k": sol.params["init"][k], "T_e0": sol.params["init"][T_e0], "n_e0": sol.params["init"][n_e0]}
+            result.update({name: values[j] for name, values in theory.items()})
+            _SPECTRUM_CACHE.setdefault(sol, {})[settings] = result
+
+    results = [_SPECTRUM_CACHE[sol][settings] for sol in sols]
+    omega = results[0]["frequencies"]
+    if any(len(result["frequencies"]) != len(omega) or not np.allclose(result["frequencies"], omega) for result in results):
+        raise ValueError("The runs have different output times, so their spectra do not share frequencies")
+
+    study = {"frequencies": omega}
+    for name in results[0]:
+        if name == "frequencies":
+            continue
+        values = [np.asarray(result[name]) for result in results]
+        stacked = np.full(run_index.shape + values[0].shape, np.nan, dtype=np.result_type(values[0].dtype, float))
+        for position in np.ndindex(run_index.shape):
+            if run_index[position] >= 0:
+                stacked[position] = values[run_index[position]]
+        study[name] = stacked
+    return study
+
+
+def clear_cache():
+    """
+    Forgets every cached spectrum
+    """
+    _SPECTRUM_CACHE.clear()
+
+
+####################
+# Helper functions #
+####################
+def _window(name: str, n: int):
+    """
+    Window function of length n by the name of the numpy function, e.g. 'hanning'
+    """
+    if name in ("hann", "hanning"):
+        return np.hanning(n)
+    if name in ("hamming", "blackman", "bartlett"):
+        return getattr(np, name)(n)
+    if name in ("boxcar", "rectangular"):
+        return np.ones(n)
+    raise ValueError(f"Unknown window '{name}'")
+
+
+def _dispersion_constants(sol):
+    """
+    (nu_ue, mu_e, epsilon_D) of a run, as used in theoretical_omega
+    """
+    physical = sol.constants["physical"]
+    return physical["nu_u"][0], physical["mu"], physical["epsilon_D"]
@@ -0,0 +1,258 @@
+import inspect
+import itertools
+import numpy as np
+from methods.sweep_dataset import SweepDataset
+from methods.save_load_data2 import load_data
+
+
+class PolynomialModel:
+    """
+    Least squares polynomial in every input, including all products of inputs up to the total degree.
+    Degree 2 is the quadratic fitted by hand in Ion_Velocity 3.
+    The uncertainty is the standard error of the fit at the point
+
+    degree: Largest total degree of the terms
+    ridge:  Small regularization of the normal equations, keeps the fit defined with few points
+    """
+
+    def __init__(self, degree: int = 2, ridge: float = 1e-10):
+        self.degree = degree
+        self.ridge  = ridge
+
+    def fit(self, X, y):
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        self.powers = np.array([powers for powers in itertools.product(range(self.degree+1), repeat=X.shape[1]) if sum(powers) <= self.degree])
+
+        features = self._features(X)
+        self.covariance = np.linalg.inv(features.T @ features + self.ridge*np.eye(len(self.powers)))
+        self.coefficients = self.covariance @ features.T @ y
+
+        dof = len(y) - len(self.powers)
+        self.variance = np.sum((features @ self.coefficients - y)**2)/dof if dof > 0 else np.nan
+        return self
+
+    def predict(self, X, return_std: bool = False):
+        features = self._features(np.asarray(X, dtype=float))
+        mean = features @ self.coefficients
+        if not return_std:
+            return mean
+        return mean, np.sqrt(np.maximum(self.variance*np.einsum("ij,jk,ik->i", features, self.covariance, features), 0))
+
+    def _features(self, X):
+        return np.prod(X[:, None, :]**self.powers[None, :, :], axis=-1)
+
+
+class GaussianProcessModel:
+    """
+    Gaussian process regression with a squared exponential kernel. Interpolates the training points and gives an
+    uncertainty growing away from them, which makes it the model of choice for deciding where to run the simulator next
+
+    length_scale: Length scale of the kernel in the scaled inputs (every input is scaled to [-1, 1]).
+                  None chooses the one with the largest marginal likelihood
+    noise:        Noise variance relative to the variance of the diagnostic
+    """
+
+    LENGTH_SCALES = np.geomspace(0.05, 5, 25)
+
+    def __init__(self, length_scale: float = None, noise: float = 1e-6):
+        self.length_scale = length_scale
+        self.noise        = noise
+
+    def fit(self, X, y):
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        self.X    = X
+        self.mean = y.mean()
+        self.scale = y.std() if y.std() > 0 else 1.0
+        residual = (y - self.mean)/self.scale
+
+        length_scales = self.LENGTH_SCALES if self.length_scale is None else [self.length_scale]
+        best = -np.inf
+        for length_scale in length_scales:
+            K = self._kernel(X, X, length_scale) + self.noise*np.eye(len(X))
+            try:
+                L = np.linalg.cholesky(K)
+            except np.linalg.LinAlgError:
+                continue
+            alpha = np.linalg.solve(L.T, np.linalg.solve(L, residual))
+            likelihood = -0.5*residual @ alpha - np.sum(np.log(np.diag(L)))
+            if likelihood > best:
+                best = likelihood
+                self.fitted_length_scale = length_scale
+                self.alpha = alpha
+                self.K_inv = np.linalg.inv(K)
+
+        if best == -np.inf:
+            raise np.linalg.LinAlgError("The kernel matrix is singular for every length scale. Try a larger noise")
+        return self
+
+    def predict(self, X, return_std: bool = False):
+        k = self._kernel(np.asarray(X, dtype=float), self.X, self.fitted_length_scale)
+        mean = self.mean + self.scale*(k @ self.alpha)
+        if not return_std:
+            return mean
+        variance = 1 - np.einsum("ij,jk,ik->i", k, self.K_inv, k)
+        return mean, self.scale*np.sqrt(np.maximum(variance, 0))
+
+    @staticmethod
+    def _kernel(A, B, length_scale: float):
+        distance = np.sum(A**2, axis=1)[:, None] + np.sum(B**2, axis=1)[None, :] - 2*A @ B.T
+        return np.exp(-np.maximum(distance, 0)/(2*length_scale**2))
+
+
+# Model families by name. Any object with fit(X, y) and predict(X, return_std) can be used instead
+MODEL_FAMILIES = {
+    "polynomial"       : PolynomialModel,
+    "gaussian_process" : GaussianProcessModel,
+}
+
+
+class Surrogate:
+    """
+    Model of a scalar diagnostic of finished runs as a function of entries of params["init"],
+    to answer queries for new parameter points without running the simulator.
+
+    inputs:     List of names in params["init"], or dict mapping input names to functions taking params["init"]
+                and returning the value, the same as the axes of SweepDataset
+    diagnostic: Key of a scalar entry of SolutionClass.data (e.g. "m_i") or function taking a SolutionClass and returning a number
+    model:      Name in MODEL_FAMILIES, or a model object with fit(X, y) and predict(X, return_std)
+    **model_args: Arguments for the model family, e.g. degree=2
+
+    Example (the shock height fit of Ion_Velocity 3):
+        surrogate = Surrogate({"n_l": None, "nrel": lambda i: i["n_r"]/i["n_l"], "trel": lambda i: i["t_r"]/i["t_l"]},
+                              shock_height, model="polynomial", degree=2).fit(SweepDataset.from_glob("DATA/Shock-shape/*", ...))
+        surrogate.cross_validate()["rmse"]
+        height, std = surrogate.predict(n_l=1.4, nrel=0.35, trel=0.25)
+    """
+
+    def __init__(self, inputs, diagnostic, model = "gaussian_process", **model_args):
+        if not isinstance(inputs, dict):
+            inputs = {name: None for name in inputs}
+        self.inputs = {name: (func if func is not None else (lambda init, name=name: init[name])) for name, func in inputs.items()}
+        self.diagnostic = diagnostic
+
+        if isinstance(model, str):
+            if model not in MODEL_FAMILIES:
+                raise ValueError(f"Unknown model family '{model}'. Families are {list(MODEL_FAMILIES)}")
+            self._make_model = lambda: MODEL_FAMILIES[model](**model_args)
+        else:
+            self._make_model = lambda: type(model)(**model_args) if model_args else _fresh_copy(model)
+
+        self.X = None
+        self.y = None
+        self.model = None
+
+    def training_data(self, runs):
+        """
+        Gives (X, y): the inputs of every run with shape (runs, inputs) and its diagnostic.
+        runs: SweepDataset, or list of SolutionClass objects and/or filenames saved with save_data
+        """
+        if isinstance(runs, SweepDataset):
+            runs = [runs.run(i) for i in range(int(np.sum(runs.run_index >= 0)))]
+
+        X, y = [], []
+        for run in runs:
+            sol = load_data(run) if isinstance(run, str) else run
+            X.append(self.coordinates(sol.params["init"]))
+            y.append(float(sol.data[self.diagnostic]) if isinstance(self.diagnostic, str) else float(self.diagnostic(sol)))
+        return np.array(X, dtype=float).reshape(len(X), len(self.inputs)), np.array(y, dtype=float)
+
+    def coordinates(self, init: dict):
+        """
+        The input values of a run from its params["init"]
+        """
+        return [func(init) for func in self.inputs.values()]
+
+    def fit(self, runs = None, X = None, y = None):
+        """
+        Trains the model on finished runs, or directly on arrays X of shape (points, inputs) and y.
+        Runs whose diagnostic is nan are left out
+        """
+        if runs is not None:
+            X, y = self.training_data(runs)
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+
+        keep = np.isfinite(y) & np.all(np.isfinite(X), axis=1)
+        self.X, self.y = X[keep], y[keep]
+        if len(self.y) == 0:
+            raise ValueError("No runs with a finite diagnostic to train on")
+
+        # Every input is scaled to [-1, 1] over the training points
+        self._low  = self.X.min(axis=0)
+        self._span = np.where(self.X.max(axis=0) > self._low, self.X.max(axis=0) - self._low, 1.0)
+
+        self.model = self._make_model().fit(self._scale(self.X), self.y)
+        return self
+
+    def predict(self, X = None, return_std: bool = True, **coords):
+        """
+        Predicts the diagnostic at new points, given as an array of shape (points, inputs) or as one value (or array) per input name.
+        Returns (prediction, uncertainty) with one value per point, or only the prediction if return_std is False
+
+        Example:
+            surrogate.predict(n_l=1.4, nrel=0.35, trel=0.25)
+            surrogate.predict(np.array([[1.4, 0.35, 0.25], [2.0, 0.2, 0.2]]))
+        """
+        if self.model is None:
+            raise RuntimeError("The surrogate has to be fitted before predicting")
+
+        if X is None:
+            values = np.broadcast_arrays(*(np.asarray(coords[name], dtype=float) for name in self.inputs))
+            shape = values[0].shape
+            X = np.stack([value.ravel() for value in values], axis=-1)
+        else:
+            X = np.atleast_2d(np.asarray(X, dtype=float))
+            shape = (len(X),)
+
+        result = self.model.predict(self._scale(X), return_std=return_std)
+        if not return_std:
+            return result.reshape(shape)
+        return result[0].reshape(shape), result[1].reshape(shape)
+
+    def cross_validate(self, folds: int = 5, seed: int = 0):
+        """
+        k-fold cross-validation of the model family on the training points.
+        Returns dict with the root mean square error, largest error, R^2 and the out of fold prediction of every training point
+        """
+        if self.model is None:
+            raise RuntimeError("The surrogate has to be fitted before cross-validating")
+
+        folds = min(folds, len(self.y))
+        order = np.random.default_rng(seed).permutation(len(self.y))
+        predictions = np.empty(len(self.y))
+        for fold in np.array_split(order, folds):
+            train = np.setdiff1d(order, fold)
+            X_train = self._scale(self.X[train])
+            model = self._make_model().fit(X_train, self.y[train])
+            predictions[fold] = model.predict(self._scale(self.X[fold]))
+
+        errors = predictions - self.y
+        total = np.sum((self.y - self.y.mean())**2)
+        return {
+            "rmse"        : float(np.sqrt(np.mean(errors**2))),
+            "max_error"   : float(np.max(np.abs(errors))),
+            "r2"          : float(1 - np.sum(errors**2)/total) if total > 0 else np.nan,
+            "predictions" : predictions,
+        }
+
+    def most_uncertain(self, candidates, n: int = 1):
+        """
+        The n candidate points (array of shape (points, inputs)) with the largest uncertainty, most uncertain first.
+        These are where running the simulator helps the surrogate the most
+        """
+        candidates = np.atleast_2d(np.asarray(candidates, dtype=float))
+        _, std = self.predict(candidates)
+        return candidates[np.argsort(-std)[:n]]
+
+    def _scale(self, X):
+        return 2*(X - self._low)/self._span - 1
+
+
+####################
+# Helper functions #
+####################
+def _fresh_copy(model):
+    """
+    Unfitted copy of a model object, made from its constructor arguments where they are stored as attributes of the same name
+    """
+    args = {name: getattr(model, name) for name in inspect.signature(type(model).__init__).parameters if name != "self" and hasattr(model, name)}
+    return type(model)(**args)
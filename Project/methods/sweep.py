@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import multiprocessing as mp
+from methods.SolutionClass2 import SolutionClass
+from methods.save_load_data2 import save_data
+
+
+def run_sweep(param_list, processes: int = None, save_names = None,
+              two_fluid_file = "../temp_plasma",
+              temp_dir = "temp",
+              errors = "raise",
+             ):
+    """
+    Runs the simulation for every parameter dict in param_list across a pool of worker processes.
+    Every run gets its own private temporary json and nc files, so the workers never overwrite each other.
+    Results are yielded as (index, result) as soon as each run finishes, where index is the position of the run in param_list.
+
+    param_list:     Iterable of parameter dicts, as given to SolutionClass
+    processes:      Number of worker processes. Defaults to the number of cores
+    save_names:     Optional list of filenames (same order as param_list) or function taking a params dict and returning a filename.
+                    If given, every run is saved with save_data inside its worker and the result is the filename instead of the SolutionClass.
+                    This keeps the memory of the main process low for large sweeps.
+    two_fluid_file: Path to the simulation executable
+    temp_dir:       Directory in which the per-run temporary files are made
+    errors:         'raise' to stop the sweep at the first run that fails, 'return' to give the exception as the result of that run instead
+
+    Example:
+        sols = [None]*len(p_list)
+        for i, sol in run_sweep(p_list):
+            sols[i] = sol
+    """
+
+    os.makedirs(temp_dir, exist_ok=True)
+
+    def jobs():
+        names = iter(save_names) if (save_names is not None and not callable(save_names)) else None
+        for i, params in enumerate(param_list):
+            if   callable(save_names): name = save_names(params)
+            elif names is not None:    name = next(names)
+            else:                      name = None
+            yield (i, params, name, two_fluid_file, temp_dir, errors)
+
+    with mp.Pool(processes) as pool:
+        for result in pool.imap_unordered(_run_single, jobs(), chunksize=1):
+            yield result
+
+
+####################
+# Helper functions #
+####################
+def _run_single(job):
+    """
+    Runs a single simulation in a private temporary directory. Is executed in the worker processes of run_sweep
+    """
+    i, params, save_name, two_fluid_file, temp_dir, errors = job
+
+    run_dir = tempfile.mkdtemp(prefix="run-", dir=temp_dir)
+    try:
+        sol = SolutionClass(params,
+                            two_fluid_file = two_fluid_file,
+                            temp_json_file = os.path.join(run_dir, "temp.json"),
+                            temp_nc_file   = os.path.join(run_dir, "temp.nc"),
+                           )
+        sol.close() # Reads everything before the temporary files are removed
+
+        if save_name is None:
+            return i, sol
+
+        save_data(sol, filename=save_name)
+        return i, save_name
+
+    except Exception as error:
+        if errors == "raise":
+            raise
+        return i, error
+
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
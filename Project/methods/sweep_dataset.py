@@ -0,0 +1,204 @@
+import numpy as np
+from methods.save_load_data2 import load_data, load_params, load_many, find_saved
+
+
+class SweepDataset:
+    """
+    Stacks the data of the runs of a parameter sweep into single arrays with one axis per swept parameter,
+    so the whole sweep can be handled with vectorized numpy operations instead of loops over the runs.
+    Runs given as filenames are only loaded with load_data the first time a field is stacked. The parameter grid only needs their params,
+    and every field is only stacked the first time it is used.
+
+    runs: List of filenames saved with save_data (without extension) and/or SolutionClass objects
+    axes: List of names in params["init"] to use as parameter axes, or dict mapping axis names to functions
+          taking params["init"] and returning the coordinate, e.g. {"nrel": lambda init: init["n_r"]/init["n_l"]}
+
+    Example:
+        sweep = SweepDataset.from_glob("DATA/Shock-shape/*", {"nrel": lambda i: i["n_r"]/i["n_l"], "n_l": None})
+        ni = sweep["ni"]                  # shape (nrel, n_l, time, x)
+        ni[sweep.index(n_l=1.2)].max(-1)  # maximum density for every nrel and time at n_l = 1.2
+    """
+
+    def __init__(self, runs: list, axes):
+        if not isinstance(axes, dict):
+            axes = {name: None for name in axes}
+
+        self.axes   = {name: (func if func is not None else (lambda init, name=name: init[name])) for name, func in axes.items()}
+        self._runs  = [_saved_name(run) if isinstance(run, str) else run for run in runs]
+        self._run_params = {}
+        self._grid  = None
+        self._stacks = {}
+
+    @classmethod
+    def from_glob(cls, pattern: str, axes):
+        """
+        Makes a sweep of every saved run matching the pattern, e.g. "DATA/Shock-shape/*"
+        """
+        return cls(find_saved(pattern), axes)
+
+    def load(self, fields: list = None, workers: int = None):
+        """
+        Loads every run that is not loaded yet in parallel with load_many
+        fields: Optional list of keys of data_full to keep, see load_data
+        """
+        filenames = [run for run in self._runs if isinstance(run, str)]
+        if len(filenames) == 0:
+            return self
+
+        loaded = load_many(filenames, fields=fields, workers=workers)
+        self._runs = [loaded[run] if isinstance(run, str) else run for run in self._runs]
+        return self
+
+    def run(self, i: int):
+        """
+        Gives the i'th run as given to the constructor, loading it if necessary
+        """
+        if isinstance(self._runs[i], str):
+            self._runs[i] = load_data(self._runs[i])
+        return self._runs[i]
+
+    @property
+    def coords(self):
+        """
+        dict with the sorted coordinate values along every parameter axis
+        """
+        return self._make_grid()[0]
+
+    @property
+    def shape(self):
+        """
+        Shape of the parameter axes
+        """
+        return tuple(len(values) for values in self.coords.values())
+
+    @property
+    def run_index(self):
+        """
+        Array with the shape of the parameter axes holding the index of the run at every point, or -1 where no run exists
+        """
+        return self._make_grid()[1]
+
+    @property
+    def t(self):
+        return np.asarray(self.run(0).data_full["t"])
+
+    @property
+    def x(self):
+        return np.asarray(self.run(0).data_full["x"])
+
+    def axis(self, name: str):
+        """
+        The axis number of a parameter axis in the stacked arrays
+        """
+        return list(self.axes).index(name)
+
+    def index(self, **coords):
+        """
+        Tuple for indexing the stacked arrays at the given parameter values. Axes not given are kept whole
+        """
+        index = []
+        for name, values in self.coords.items():
+            if name not in coords:
+                index.append(slice(None))
+                continue
+            i = np.flatnonzero(np.isclose(values, coords[name]))
+            if len(i) == 0:
+                raise ValueError(f"{name} = {coords[name]} is not in the sweep. Values are {values}")
+            index.append(int(i[0]))
+        return tuple(index)
+
+    def params(self, *index):
+        """
+        The params of the run at the given position of the parameter axes
+        """
+        return self._params(int(self.run_index[index]))
+
+    def stack(self, key: str, time_index = None):
+        """
+        Stacks a field of every run into one contiguous array of shape (parameter axes..., field shape...).
+        Points of the parameter grid without a run are nan.
+        key:        Key in data_full, e.g. "ni"
+        time_index: Optional index or slice of the times to keep, which avoids stacking every time if only a few are needed
+        """
+        stack_key = (key, repr(time_index))
+        if stack_key in self._stacks:
+            return self._stacks[stack_key]
+
+        run_index = self.run_index
+        stacked = None
+        for position in np.ndindex(run_index.shape):
+            i = run_index[position]
+            if i < 0:
+                continue
+
+            field = np.asarray(self.run(i).data_full[key])
+            if time_index is not None:
+                field = field[time_index]
+
+            if stacked is None:
+                stacked = np.full(run_index.shape + field.shape, np.nan, dtype=np.result_type(field.dtype, float))
+            elif field.shape != stacked.shape[run_index.ndim:]:
+                raise ValueError(f"Run {i} has '{key}' of shape {field.shape}, the other runs have shape {stacked.shape[run_index.ndim:]}")
+            stacked[position] = field
+
+        self._stacks[stack_key] = stacked
+        return stacked
+
+    def __getitem__(self, key: str):
+        return self.stack(key)
+
+    def clear(self):
+        """
+        Removes the stacked arrays to free memory
+        """
+        self._stacks = {}
+
+    ####################
+    # Helper functions #
+    ####################
+    def _make_grid(self):
+        """
+        Finds the coordinates of every run and places the runs on the grid of parameter values
+        """
+        if self._grid is not None:
+            return self._grid
+
+        # Rounds so values like 0.6*0.5 and 0.3 are on the same point of the grid
+        run_coords = np.array([[float("{:.10g}".format(func(self._params(i)["init"]))) for func in self.axes.values()]
+                               for i in range(len(self._runs))]).reshape(len(self._runs), len(self.axes))
+
+        coords  = {}
+        indices = []
+        for a, name in enumerate(self.axes):
+            values, inverse = np.unique(run_coords[:, a], return_inverse=True)
+            coords[name] = values
+            indices.append(inverse.reshape(-1))
+
+        run_index = np.full(tuple(len(values) for values in coords.values()), -1, dtype=int)
+        for i, position in enumerate(zip(*indices)):
+            if run_index[position] >= 0:
+                raise ValueError(f"Runs {run_index[position]} and {i} have the same parameter values {run_coords[i]}")
+            run_index[position] = i
+
+        self._grid = (coords, run_index)
+        return self._grid
+
+    def _params(self, i: int):
+        """
+        The params of the i'th run, read without loading the data of runs that are not loaded yet
+        """
+        if not isinstance(self._runs[i], str):
+            return self._runs[i].params
+        if i not in self._run_params:
+            self._run_params[i] = load_params(self._runs[i])
+        return self._run_params[i]
+
+
+def _saved_name(path: str):
+    """
+    The filename of a saved run without extension, as used by load_data. Raises an error if there is no run saved there
+    """
+    found = find_saved([path])
+    if len(found) == 0:
+        raise FileNotFoundError(f"No saved run '{path}': neither a .run directory nor a .json file exists there")
+    return found[0]
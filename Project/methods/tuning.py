@@ -0,0 +1,123 @@
+import copy
+import itertools
+import numpy as np
+from methods.sweep import run_sweep
+
+# Poisson solver settings tried by tune_poisson. Every entry is expanded to all combinations of its listed values.
+# Ranges follow the comments in make_plasma_input
+POISSON_SEARCH_SPACE = [
+    {"type": "anderson", "mMax": [3, 10], "damping": [1e-1, 1e-2, 1e-3]},
+    {"type": "gmres",    "max_inner": [10, 30], "max_outer": [3, 10]},
+    {"type": "bicgstab", "l_input": [2, 4]},
+    {"type": "cg"},
+]
+
+
+def expand_search_space(search_space: list = None):
+    """
+    Gives every Poisson configuration (dict of settings to put into params["poisson"]) described by the search space
+    """
+    if search_space is None:
+        search_space = POISSON_SEARCH_SPACE
+
+    configs = []
+    for entry in search_space:
+        keys   = list(entry.keys())
+        values = [value if isinstance(value, list) else [value] for value in entry.values()]
+        for combination in itertools.product(*values):
+            configs.append(dict(zip(keys, combination)))
+    return configs
+
+
+def tune_poisson(params: dict, search_space: list = None,
+                 probe_tend: float = None, probe_fraction: float = 0.05,
+                 rtol: float = 1e-4, fields = ("ne", "ni", "potential"),
+                 processes: int = 1,
+                 two_fluid_file = "../temp_plasma",
+                 report: bool = True,
+                ):
+    """
+    Finds the fastest Poisson solver settings for a params dict using short probe runs.
+    Every configuration of the search space is run up to probe_tend and compared at the final time with a probe of the given params.
+    Configurations that fail, give nan, or differ from the reference by more than rtol (relative 2-norm of every field) are rejected.
+    The rest are ranked by the duration reported by the simulator, then by its number of function calls and failed steps.
+
+    Returns (params for the full run with the fastest validated Poisson settings, list of result dicts for every configuration, fastest first)
+
+    search_space:   List of dicts of settings, see POISSON_SEARCH_SPACE
+    probe_tend:     End time of the probe runs. Defaults to probe_fraction of the end time of params
+    rtol:           Largest relative difference to the reference for a configuration to be accepted
+    fields:         Fields compared with the reference
+    processes:      Number of probes run at once. Runs at the same time compete for the cores, so durations are most comparable with 1
+    """
+
+    def probe(poisson):
+        probe_params = copy.deepcopy(params)
+        probe_params["poisson"].update(poisson)
+        probe_params["output"]["tend"]   = probe_tend if probe_tend is not None else params["output"]["tend"]*probe_fraction
+        probe_params["output"]["maxout"] = 1
+        return probe_params
+
+    configs = expand_search_space(search_space)
+    probes  = [probe({})] + [probe(config) for config in configs]
+
+    sols = [None]*len(probes)
+    for i, sol in run_sweep(probes, processes=processes, two_fluid_file=two_fluid_file, errors="return"):
+        sols[i] = sol
+        if report and i > 0: print(f"Probe {i}/{len(configs)}: {configs[i-1]}")
+
+    reference = sols[0]
+    if not _finished(reference, probes[0]):
+        raise RuntimeError("The reference probe with the given Poisson settings did not finish")
+
+    results = []
+    for config, probe_params, sol in zip(configs, probes[1:], sols[1:]):
+        result = {"poisson": config, "accepted": False, "duration": np.inf, "nsteps": None, "nfailed": None, "difference": np.inf}
+        if _finished(sol, probe_params):
+            result.update({
+                "duration"   : float(sol.data["duration"]),
+                "nsteps"     : int(sol.data["nsteps"]),
+                "nfailed"    : int(sol.data["nfailed"]),
+                "difference" : max(_relative_difference(sol.data[key], reference.data[key]) for key in fields),
+            })
+            result["accepted"] = bool(result["difference"] <= rtol)
+        results.append(result)
+
+    results.sort(key=lambda result: (not result["accepted"], result["duration"], (result["nsteps"] or 0) + (result["nfailed"] or 0)))
+
+    if not results or not results[0]["accepted"]:
+        if report: print("No configuration was accepted. Keeping the given Poisson settings")
+        return copy.deepcopy(params), results
+
+    best = copy.deepcopy(params)
+    best["poisson"].update(results[0]["poisson"])
+    if report:
+        print("Fastest: {} with duration {:.4g}s (reference {:.4g}s)".format(results[0]["poisson"], results[0]["duration"], float(reference.data["duration"])))
+
+    return best, results
+
+
+####################
+# Helper functions #
+####################
+def _finished(sol, params: dict):
+    """
+    Whether the simulation reached its end time without nan. Runs that failed completely are given as exceptions by run_sweep
+    """
+    if isinstance(sol, Exception):
+        return False
+
+    t = float(sol.data["t"])
+    if not np.isclose(t, params["output"]["tend"], rtol=1e-6):
+        return False
+    return all(np.all(np.isfinite(sol.data[key])) for key in ("ne", "ni", "potential"))
+
+
+def _relative_difference(arr, ref):
+    """
+    Relative 2-norm difference between an array and a reference array
+    """
+    scale = np.linalg.norm(ref)
+    if scale == 0:
+        return float(np.linalg.norm(arr))
+    return float(np.linalg.norm(np.asarray(arr) - np.asarray(ref)) / scale)
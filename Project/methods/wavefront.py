@@ -29,48 +29,68 @@ def get_wavefront_datapoint(data_full, data_key="ne", offset=0, direction="right
     interpolate: Whether to interpolate the data. If False the datapoint right after the crossing of 'offset' will be returned.
     """
 
-    # TODO: make a more sophisticated inverse lerp scheme to determine exact x-point
-
-    changes = get_sign_change_indices(data_full, data_key=data_key, offset=offset)
-
-    # We take the positive changes and turn them into datapoints
-    data_t = []
-    data_y = []
-    for ti, c in enumerate(changes):
-        if   change == "both":
-            sign_changes = np.concatenate((c["positives"], c["negatives"]))
-        elif change == "negative":
-            sign_changes = c["negatives"]
-        elif change == "positive":
-            sign_changes = c["positives"]
-        else:
-            raise ValueError(f"change should be either 'both', 'negative' or 'positive'. Was '{change}'")
-        
-        # If no points fit the description we append nan and continue to next iteration
-        if len(sign_changes) == 0:
-            data_t.append(np.nan)
-            data_y.append(np.nan)
-            continue
-        
-        # Returns the rightmost or leftmost datapoint
-        if   direction == "right":
-            yi = np.max(sign_changes) # Rightmost
-        elif direction == "left":
-            yi = np.min(sign_changes) # Leftmost
-        else:
-            raise ValueError(f"direction should be either 'right' or 'left'. Was '{direction}'")
+    data_y = get_wavefront_positions(data_full[data_key], data_full["x"], offsets=offset, direction=direction, change=change, interpolate=interpolate)[0]
+
+    # Times without a front are nan as well
+    data_t = np.where(np.isnan(data_y), np.nan, data_full["t"])
+
+    return (list(data_t), list(data_y))
 
-        # Linear interpolation of points crossing offset, since points will never perfectly align with the probe height
-        if interpolate:
-            a = (data_full[data_key][ti,yi] - data_full[data_key][ti,yi-1]) / (data_full["x"][yi] - data_full["x"][yi-1])
-            b = data_full[data_key][ti,yi-1] - a * data_full["x"][yi-1]
-            x_lerp = (offset - b)/a
-            data_y.append(x_lerp)
 
+def get_wavefront_positions(data, x, offsets=0, direction="right", change="both", interpolate=True):
+    """
+    Gets the positions of the wavefronts for many offsets, times and runs at once.
+    Same as get_wavefront_datapoint, but for whole arrays. Times without a crossing give nan.
+    data:        Array of shape (..., x), e.g. (time, x) for a single run or (runs..., time, x) for a stacked sweep
+    x:           Grid positions. Shape (x,) or broadcastable to the shape of data
+    offsets:     Single offset or list of offsets. Loops over the offsets, everything else is vectorized
+    direction:   Taking the rightmost or leftmost point
+    change:      Only looks at the specified slope direction: 'both', 'negative' or 'positive'
+    interpolate: Whether to linearly interpolate between the points around the crossing. If False the datapoint right after the crossing is used.
+
+    Returns array of shape (offsets, ...) with the front positions
+    """
+
+    if change not in ("both", "negative", "positive"):
+        raise ValueError(f"change should be either 'both', 'negative' or 'positive'. Was '{change}'")
+    if direction not in ("right", "left"):
+        raise ValueError(f"direction should be either 'right' or 'left'. Was '{direction}'")
+
+    data    = np.asarray(data)
+    x       = np.broadcast_to(np.asarray(x), data.shape)
+    offsets = np.atleast_1d(offsets)
+
+    positions = np.empty((len(offsets),) + data.shape[:-1])
+    if data.shape[-1] < 2:
+        # A single point has no crossings
+        positions[:] = np.nan
+        return positions
+
+    for oi, offset in enumerate(offsets):
+        shifted = data - offset
+
+        # Sign changes between index j and j+1. Same as sgn_change: touching zero does not count as a change
+        sign_diff = np.diff(np.sign(shifted), axis=-1)
+        if   change == "both":     crossings = np.abs(sign_diff) == 2
+        elif change == "negative": crossings = sign_diff == -2
+        else:                      crossings = sign_diff ==  2
+
+        # Index j of the rightmost or leftmost crossing
+        if direction == "right":
+            j = crossings.shape[-1]-1 - np.argmax(crossings[..., ::-1], axis=-1)
         else:
-            data_y.append(data_full["x"][yi])
+            j = np.argmax(crossings, axis=-1)
+        j = j[..., None]
+
+        x1 = np.take_along_axis(x, j+1, axis=-1)[..., 0]
+        if interpolate:
+            # Linear interpolation of points crossing offset, since points will never perfectly align with the probe height
+            x0 = np.take_along_axis(x,       j,   axis=-1)[..., 0]
+            y0 = np.take_along_axis(shifted, j,   axis=-1)[..., 0]
+            y1 = np.take_along_axis(shifted, j+1, axis=-1)[..., 0]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x1 = x0 - y0 * (x1 - x0) / (y1 - y0)
 
+        positions[oi] = np.where(crossings.any(axis=-1), x1, np.nan)
 
-        data_t.append(data_full["t"][ti])
-        
-    return (data_t, data_y)
\ No newline at end of file
+    return positions